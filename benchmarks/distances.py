@@ -0,0 +1,29 @@
+# python -m benchmarks.distances
+# Compares finding the closest interest location of many points with the scalar distance function
+# and with the vectorized distance matrix
+import random
+import time
+
+from src.lat_long import closest_interest_locations, distance, interest_locations
+
+
+def main():
+    names, interest_lat_longs, _ = interest_locations()
+    print(f'{"points":>10} {"scalar s":>10} {"matrix s":>10}')
+    for num_points in [10_000, 100_000]:
+        lat_longs = [(random.uniform(47, 55), random.uniform(6, 15)) for _ in range(num_points)]
+
+        start = time.perf_counter()
+        for lat_long in lat_longs:
+            min((distance(lat_long, tuple(other)), name) for name, other in zip(names, interest_lat_longs))
+        scalar_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        closest_interest_locations(lat_longs)
+        matrix_seconds = time.perf_counter() - start
+
+        print(f'{num_points:>10} {scalar_seconds:>10.3f} {matrix_seconds:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
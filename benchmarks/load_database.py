@@ -0,0 +1,57 @@
+# python -m benchmarks.load_database
+# Times loading the database with 10k and 100k entries from the old JSON file and from SQLite,
+# and the parsing of the scrape timestamps with pandas (as done before) and with the fixed-format fast path
+import json
+import os
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+
+from benchmarks.synthetic import make_database
+from src.database import Database
+from src.types import DatabaseFactory
+from src.util import custom_asdict, iter_json_array, parse_timestamp
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    print(f'{"entries":>10} {"json s":>10} {"sqlite s":>10} {"pandas s":>10} {"fast s":>10}')
+    for num_entries in [10_000, 100_000]:
+        database_entries = make_database(num_entries, entries_per_offer=2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, 'db.json')
+            with open(json_path, 'w') as file:
+                json.dump(custom_asdict(database_entries), file)
+
+            with Database(os.path.join(directory, 'db.sqlite3')) as database:
+                database.upsert_entries(database_entries)
+
+                json_seconds = timed(
+                    lambda json_path=json_path: [
+                        DatabaseFactory.parse_entry(data) for data in iter_json_array(json_path)
+                    ]
+                )
+                sqlite_seconds = timed(database.load_entries)
+
+        timestamps = [custom_asdict(entry.metadata.offer.scraped_on) for entry in database_entries]
+        warnings.simplefilter('ignore', UserWarning)  # pandas warns about dayfirst with ISO timestamps
+        pandas_seconds = timed(
+            lambda timestamps=timestamps: [pd.to_datetime(value, dayfirst=True) for value in timestamps]
+        )
+        fast_seconds = timed(lambda timestamps=timestamps: [parse_timestamp(value) for value in timestamps])
+
+        print(
+            f'{num_entries:>10} {json_seconds:>10.3f} {sqlite_seconds:>10.3f} {pandas_seconds:>10.3f} {fast_seconds:>10.3f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+# python -m benchmarks.memory_per_entry
+# Measures how many bytes each entry loaded from the database keeps in memory (Entry, Metadata, Offer, User and strings)
+import json
+import os
+import tempfile
+import tracemalloc
+
+from benchmarks.synthetic import make_database
+from src.types import DatabaseFactory
+from src.util import custom_asdict, iter_json_array
+
+
+def main():
+    print(f'{"entries":>10} {"MB":>10} {"bytes / entry":>14}')
+    for num_entries in [10_000, 100_000]:
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, 'db.json')
+            with open(json_path, 'w') as file:
+                json.dump(custom_asdict(make_database(num_entries, entries_per_offer=2)), file)
+
+            tracemalloc.start()
+            database_entries = [DatabaseFactory.parse_entry(data) for data in iter_json_array(json_path)]
+            allocated, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        assert len(database_entries) == num_entries
+        print(f'{num_entries:>10} {allocated / 1e6:>10.1f} {allocated / num_entries:>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
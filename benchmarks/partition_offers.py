@@ -0,0 +1,28 @@
+# python -m benchmarks.partition_offers
+# Shows that partition_offers scales linearly with the number of database offers and current offers
+import time
+
+from benchmarks.synthetic import make_current_offers, make_database
+from src.__main__ import partition_offers
+
+
+def main():
+    print(f'{"entries":>10} {"offers":>10} {"seconds":>10} {"ns / item":>10}')
+    for num_entries in [5_000, 20_000, 80_000, 320_000]:
+        num_offers = num_entries // 4
+        database_entries = make_database(num_entries, entries_per_offer=2)
+        database_offer_ids = {entry.metadata.offer.id for entry in database_entries}
+        current_offer_ids = {offer.id for offer in make_current_offers(num_offers, num_known=num_offers // 2)}
+
+        start = time.perf_counter()
+        _, old_offer_ids, sold_offer_ids = partition_offers(current_offer_ids, database_offer_ids)
+        elapsed = time.perf_counter() - start
+
+        assert len(old_offer_ids) + len(sold_offer_ids) == len(database_offer_ids)
+        print(
+            f'{num_entries:>10} {num_offers:>10} {elapsed:>10.4f} {elapsed / (num_entries + num_offers) * 1e9:>10.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
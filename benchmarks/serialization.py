@@ -0,0 +1,49 @@
+# python -m benchmarks.serialization
+# Times dumping and loading the full database with 10k and 100k entries: converting the entries with custom_asdict,
+# encoding them as JSON (orjson if installed, otherwise the json module) and writing to and reading from SQLite
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import make_database
+from src.database import Database
+from src.util import custom_asdict, json_dumps, json_loads
+from src.util.json import orjson
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    print(f'JSON backend: {"orjson" if orjson is not None else "json"}')
+    print(f'{"entries":>10} {"asdict s":>10} {"encode s":>10} {"decode s":>10} {"dump s":>10} {"load s":>10}')
+    for num_entries in [10_000, 100_000]:
+        database_entries = make_database(num_entries, entries_per_offer=2)
+
+        asdict_seconds = timed(lambda database_entries=database_entries: custom_asdict(database_entries))
+        data = custom_asdict(database_entries)
+        encode_seconds = timed(lambda data=data: json_dumps(data))
+        text = json_dumps(data)
+        decode_seconds = timed(lambda text=text: json_loads(text))
+
+        with tempfile.TemporaryDirectory() as directory:
+            with Database(os.path.join(directory, 'db.sqlite3')) as database:
+                dump_seconds = timed(
+                    lambda database=database, database_entries=database_entries: database.upsert_entries(
+                        database_entries
+                    )
+                )
+            with Database(os.path.join(directory, 'db.sqlite3')) as database:
+                load_seconds = timed(database.load_entries)
+
+        print(
+            f'{num_entries:>10} {asdict_seconds:>10.3f} {encode_seconds:>10.3f} {decode_seconds:>10.3f} '
+            f'{dump_seconds:>10.3f} {load_seconds:>10.3f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import random
+from datetime import datetime
+
+from src.types import Entry, Metadata, Offer, User
+from src.types_to_search import Sail
+
+
+def make_offer(index: int, num_users: int = 1000) -> Offer:
+    user_id = str(index % num_users)
+    return Offer(
+        id=str(1_000_000 + index),
+        title=f'North Sail {index % 10}.{index % 7} Windsurf Segel',
+        description='Segel mit wenigen Gebrauchsspuren. 2 Band-Camber als Profilgeber. ' * 3,
+        price=f'{50 + index % 400} € VB',
+        location=f'{76000 + index % 900} Karlsruhe',
+        date='17.10.2024',
+        link=f'https://www.kleinanzeigen.de/s-anzeige/north-sail/{1_000_000 + index}-230-9000',
+        sold=False,
+        image_urls=[f'https://img.kleinanzeigen.de/api/v1/prod-ads/images/{index}-{i}.jpg' for i in range(3)],
+        scraped_on=datetime(2024, 10, 17, 13, 0, 0),
+        user=User(
+            id=user_id,
+            name=f'User {user_id}',
+            rating='TOP Zufriedenheit',
+            all_offers_link=f'https://www.kleinanzeigen.de/s-bestandsliste.html?userId={user_id}',
+        ),
+    )
+
+
+def make_entry(offer: Offer) -> Entry:
+    return Sail(
+        metadata=Metadata(type='sail', offer=offer, lat_long=(49.0, 8.4)),
+        size='6.5',
+        brand='North Spectro',
+        mast_length='460',
+        boom_size='195',
+        sail_type='Freeride',
+        year='2015',
+        state='used',
+    )
+
+
+def make_database(num_entries: int, entries_per_offer: int = 1) -> list[Entry]:
+    return [make_entry(make_offer(index // entries_per_offer)) for index in range(num_entries)]
+
+
+def make_current_offers(num_offers: int, num_known: int, seed: int = 0) -> list[Offer]:
+    # num_known of the current offers are already in the database, the others are new
+    rng = random.Random(seed)
+    known = rng.sample(range(num_known * 4), num_known)
+    new = range(10_000_000, 10_000_000 + num_offers - num_known)
+    return [make_offer(index) for index in [*known, *new]]
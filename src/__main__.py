@@ -1,126 +1,104 @@
-import json
+import asyncio
+from dataclasses import fields
+from datetime import datetime, timedelta
+from typing import Collection
 
 from src.excel_export import export_to_excel
 from src.extract_using_gpt import extract_offer_details
 from src.scraper import BaseScraper
 from src.scraper_dailydose import ScraperDailyDose
 from src.scraper_kleinanzeigen import ScraperKleinanzeigen
-from src.config import CURRENT_OFFERS_FILE, DB_FILE, DO_REQUERY_OLD_OFFERS, EMAILS_TO_NOTIFY, EXCEL_EXPORT_FILE
-from src.lat_long import distance, extract_lat_long, plz_to_lat_long
-from src.types import DatabaseFactory, Entry, Offer, list_entries_of_type
+from src.config import (
+    CURRENT_OFFERS_FILE,
+    DATABASE_FILE,
+    DB_FILE,
+    DO_REQUERY_OLD_OFFERS,
+    EMAILS_TO_NOTIFY,
+    EXCEL_EXPORT_FILE,
+    FULL_CRAWL_INTERVAL_DAYS,
+    INCREMENTAL_CRAWL,
+)
+from src.lat_long import (
+    extract_lat_long,
+    extract_plz,
+    is_in_interest_locations,
+    is_known_plz,
+    is_plz_in_interest_locations,
+    plz_to_lat_long,
+)
+from src.database import Database, KnownOffers, SeenOffers
+from src.types import Entry, Offer, list_entries_of_type, update_closest_interest_locations
 from src.types_to_search import ALL_TYPES
-from src.util import timeblock, dump_json, send_mail, date_str, async_gpt_request, run_in_batches
+from src.util import (
+    timeblock,
+    json_dumper,
+    send_mail,
+    date_str,
+    async_gpt_request,
+    run_in_batches,
+    stream_pipeline,
+    merge_async_iterators,
+    Stage,
+    HttpClient,
+    print_cache_statistics,
+    flush_caches,
+    gpt_token_usage,
+    gpt_scheduler,
+    close_gpt_clients,
+)
 from src.util.string import parse_numeric
 
 
-def load_database(path: str) -> list[Entry]:
-    try:
-        with open(path, 'r') as file:
-            return DatabaseFactory.from_json(json.load(file))
-    except FileNotFoundError:
-        return []
-
-
 def partition_offers(
-    all_current_offers: list[Offer], database_entries: list[Entry]
-) -> tuple[list[Offer], list[tuple[Offer, Entry]], list[Entry]]:
-    # partition into: new offers which are not yet in the database, offers which are already in the database but still in the current offers, and offers which are no longer in the current offers
-    new_offers: list[Offer] = []
-
-    for offer in set(all_current_offers):
-        if not any(entry.metadata.offer.id == offer.id for entry in database_entries):
-            new_offers.append(offer)
-
-    old_offers: list[tuple[Offer, Entry]] = []
-    sold_offers: list[Entry] = []
-
-    for entry in database_entries:
-        if not any(offer.id == entry.metadata.offer.id for offer in all_current_offers):
-            sold_offers.append(entry)
+    current_offer_ids: Collection[str], database_offer_ids: Collection[str]
+) -> tuple[list[str], list[str], list[str]]:
+    # partition into the ids of: new offers which are not yet in the database, offers which are already in the database and still in the current offers, and the database offers which are no longer in the current offers
+    # Only the ids are needed, so neither the current offers nor the entries of the database have to be kept in memory
+    # Both sides are sets or dicts of ids, which keeps this linear in the number of offers in the database and current offers
+    new_offer_ids: list[str] = []
+    old_offer_ids: list[str] = []
+    for offer_id in current_offer_ids:
+        if offer_id in database_offer_ids:
+            old_offer_ids.append(offer_id)
         else:
-            offer = next(offer for offer in all_current_offers if offer.id == entry.metadata.offer.id)
-            old_offers.append((offer, entry))
-
-    return new_offers, old_offers, sold_offers
-
-
-def filter_based_on_keywords(new_offers: list[Offer]) -> list[Offer]:
-    from src.config_interests import TITLE_NO_GO_KEYWORDS
+            new_offer_ids.append(offer_id)
 
-    return [
-        offer
-        for offer in new_offers
-        if not any(keyword.lower() in offer.title.lower() for keyword in TITLE_NO_GO_KEYWORDS)
-    ]
+    sold_offer_ids = [offer_id for offer_id in database_offer_ids if offer_id not in current_offer_ids]
 
+    return new_offer_ids, old_offer_ids, sold_offer_ids
 
-async def filter_based_on_location(new_offers: list[Offer]) -> list[tuple[Offer, tuple[float, float]]]:
-    from src.config_interests import INTEREST_LOCATIONS
 
-    filtered_new_offers: list[tuple[Offer, tuple[float, float]]] = []
-
-    for offer in new_offers:
-        if not offer.location.strip():
-            print(f'Offer: {offer.title} has no location - check manually: {offer.link}')
-            continue
+def has_no_go_keywords(offer: Offer) -> bool:
+    from src.config_interests import TITLE_NO_GO_KEYWORDS
 
-        lat_long = await extract_lat_long(offer.location)
+    return any(keyword.lower() in offer.title.lower() for keyword in TITLE_NO_GO_KEYWORDS)
 
-        if any(distance(lat_long, plz_to_lat_long(location)) < radius for location, radius, _ in INTEREST_LOCATIONS):
-            filtered_new_offers.append((offer, lat_long))
 
-    return filtered_new_offers
+async def lat_long_if_in_interest_locations(offer: Offer) -> tuple[float, float] | None:
+    if not offer.location.strip():
+        print(f'Offer: {offer.title} has no location - check manually: {offer.link}')
+        return None
 
+    # Offers with a known postal code are decided with a set lookup, all others are located first
+    plz = extract_plz(offer.location)
+    if plz is not None and is_known_plz(plz):
+        return plz_to_lat_long(plz) if is_plz_in_interest_locations(plz) else None
 
-async def filter_offers(new_offers: list[Offer]) -> list[tuple[Offer, tuple[float, float]]]:
-    filtered_based_on_keywords = filter_based_on_keywords(new_offers)
-    filtered_based_on_location = await filter_based_on_location(filtered_based_on_keywords)
-    return filtered_based_on_location
+    lat_long = await extract_lat_long(offer.location)
 
+    if is_in_interest_locations(lat_long):
+        return lat_long
 
-def update_sold_status(
-    new_offers: list[Offer],
-    old_offers: list[tuple[Offer, Entry]],
-    sold_offers: list[Entry],
-) -> None:
-    for entry in sold_offers:
-        entry.metadata.offer.sold = True
+    return None
 
-    for entry in new_offers:
-        entry.sold = False
 
+def update_sold_status(old_offers: list[tuple[Offer, Entry]]) -> None:
+    # The sold offers are marked directly in the database, see Database.mark_sold
+    # The new offers are scraped as not sold, the old offers which are listed again are not sold anymore
     for offer, entry in old_offers:
         entry.metadata.offer.sold = False
 
 
-async def extract_new_offer_details(filtered_new_offers: list[tuple[Offer, tuple[float, float]]]) -> list[Entry]:
-    with timeblock('extracting the details of the new offers'):
-
-        async def _extract(offer_lat_long: tuple[Offer, tuple[float, float]]) -> list[Entry]:
-            offer, lat_long = offer_lat_long
-            response = await extract_offer_details(offer, lat_long)
-            await asyncio.sleep(60)  # To not get rate limited
-            return response
-
-        await BaseScraper.scrape_offer_images(
-            [offer for offer, _ in filtered_new_offers],
-            5,  # Min of all scrapers batch sizes
-        )
-        details = await run_in_batches(
-            filtered_new_offers,
-            15,
-            _extract,
-            desc='Extracting offer details',
-        )
-
-    return [
-        extracted_detail
-        for extracted_details in details
-        for extracted_detail in extracted_details or []
-        if extracted_detail is not None
-    ]
-
-
 async def update_old_offers(old_offers: list[tuple[Offer, Entry]]) -> None:
     with timeblock('updating old offers'):
         for offer, entry in old_offers:
@@ -139,8 +117,8 @@ async def update_old_offers(old_offers: list[tuple[Offer, Entry]]) -> None:
                     print(f'New description: {offer.description}')
                 # reextract the offer details via llm
                 new_entry_details = await extract_offer_details(offer, entry.metadata.lat_long)
-                for key, value in new_entry_details.__dict__.items():
-                    setattr(entry, key, value)
+                for f in fields(new_entry_details):
+                    setattr(entry, f.name, getattr(new_entry_details, f.name))
             # update the entry in the database
             offer.scraped_on = entry.metadata.offer.scraped_on
             entry.metadata.offer = offer
@@ -247,76 +225,181 @@ def get_entry_details_readable(entry: Entry) -> str:
     return text
 
 
-async def update_entries_and_fetch_new_offers(all_offers: list[Offer]) -> list[Entry]:
-    # Updates the database with the new offers and fetches the details of the new offers
-    # Returns the details of the new offers and updates the database with the updates to the old offers and the newly fetched details
-
-    database_entries = load_database(DB_FILE)
+async def scrape_and_process_offers(
+    database: Database, scrapers: list[BaseScraper], search_urls: list[str]
+) -> list[Entry]:
+    # Streams the offers of all scrapers through the pipeline: current offers -> keyword filter -> location filter
+    # -> images -> extraction -> database. New offers reach the LLM while the other offer pages are still being fetched.
+    # Once all offers are scraped, the old offers are updated, the sold offers are marked and the changes are stored.
+    # Returns the details of the new offers.
+
+    # Only the index of the database is loaded up front, entries are loaded once they are needed
+    database_index = database.load_index()
+    known_offers = KnownOffers(database, database_index)
+    seen_offers = SeenOffers(database)
+
+    # Only the ids of the current offers are kept, and the current version of the offers which are already stored,
+    # so the memory does not grow with the new offers of the crawl
+    current_offer_ids: set[str] = set()
+    current_old_offers: dict[str, Offer] = {}
+    extracted_details: list[Entry] = []
+
+    with json_dumper(CURRENT_OFFERS_FILE) as dump_current_offer:
+
+        async def record_current_offer(offer: Offer) -> Offer | None:
+            dump_current_offer(offer)
+            if offer.id in current_offer_ids:
+                return None  # The same offer can be found by multiple search URLs
+            current_offer_ids.add(offer.id)
+            if offer.id in database_index:
+                current_old_offers[offer.id] = offer
+                return None  # Already in the database, only needs to be updated below
+            return offer
+
+        async def filter_keywords(offer: Offer) -> Offer | None:
+            return None if has_no_go_keywords(offer) else offer
+
+        async def filter_location(offer: Offer) -> tuple[Offer, tuple[float, float]] | None:
+            if lat_long := await lat_long_if_in_interest_locations(offer):
+                return offer, lat_long
+            return None
+
+        async def scrape_images(offer_lat_long: tuple[Offer, tuple[float, float]]) -> tuple[Offer, tuple[float, float]]:
+            await BaseScraper.scrape_offer_images(offer_lat_long[0])
+            return offer_lat_long
+
+        async def extract(offer_lat_long: tuple[Offer, tuple[float, float]]) -> list[Entry]:
+            offer, lat_long = offer_lat_long
+            return await extract_offer_details(offer, lat_long)
+
+        async def store(entries: list[Entry]) -> list[Entry]:
+            update_closest_interest_locations([entry.metadata for entry in entries])
+            database.upsert_entries(entries)
+            extracted_details.extend(entries)
+            return entries
+
+        with timeblock('scraping and processing all offers'):
+            async for _ in stream_pipeline(
+                merge_async_iterators(
+                    *(scraper.stream_all_offers(search_urls, known_offers, seen_offers) for scraper in scrapers)
+                ),
+                [
+                    Stage('current offers', record_current_offer),
+                    Stage('keyword filter', filter_keywords),
+                    Stage('location filter', filter_location, concurrency=5),
+                    Stage('offer images', scrape_images, concurrency=5),
+                    Stage('extraction', extract, concurrency=15),
+                    Stage('database', store),
+                ],
+            ):
+                pass
 
-    new_offers, old_offers, sold_offers = partition_offers(all_offers, database_entries)
+    new_offer_ids, old_offer_ids, sold_offer_ids = partition_offers(current_offer_ids, database_index)
 
-    filtered_new_offers = await filter_offers(new_offers)
+    # If the incremental mode skipped pages of a website, its offers which were not seen are not necessarily sold
+    for scraper in scrapers:
+        if scraper.is_crawl_complete:
+            database.record_full_crawl(scraper.base_url, datetime.now())
+        else:
+            sold_offer_ids = [
+                offer_id
+                for offer_id in sold_offer_ids
+                if not database_index[offer_id].link.startswith(scraper.base_url)
+            ]
 
-    print(f'Total new offers: {len(new_offers)}')
-    print(f'Filtered new offers: {len(filtered_new_offers)}')
-    print(f'Old offers: {len(old_offers)}')
-    print(f'Sold offers: {len(sold_offers)}')
+    print(f'Total new offers: {len(new_offer_ids)}')
+    print(f'Extracted new offers: {len(extracted_details)}')
+    print(f'Old offers: {len(old_offer_ids)}')
+    print(f'Sold offers: {len(sold_offer_ids)}')
 
-    update_sold_status(new_offers, old_offers, sold_offers)
+    # One offer can have multiple entries (e.g. a full set), each of them is paired with the current offer
+    old_entries = database.load_entries(offer_ids=old_offer_ids)
+    old_offer_entries = [(current_old_offers[entry.metadata.offer.id], entry) for entry in old_entries]
 
-    await update_old_offers(old_offers)
+    update_sold_status(old_offer_entries)
+    database.mark_sold(sold_offer_ids)
 
-    # extract the details of the new offers
-    extracted_details = await extract_new_offer_details(filtered_new_offers)
+    await update_old_offers(old_offer_entries)
 
-    # store everything in the database
-    new_database_entries = extracted_details + database_entries
-    dump_json(new_database_entries, DB_FILE)
+    # store the updates of the old offers in the database, the new offers are already stored
+    database.upsert_entries(old_entries)
 
     return extracted_details
 
 
-async def main():
-    from src.config_interests import WINDSURF_SEARCH_URLS
-
-    all_offers: list[Offer] = []
-    ALL_SCRAPERS: list[BaseScraper] = [
-        # ScraperKleinanzeigen(max_pages_to_scrape=25),
-        # ScraperDailyDose(max_pages_to_scrape=10),
-        ScraperKleinanzeigen(max_pages_to_scrape=5),
-        ScraperDailyDose(max_pages_to_scrape=5),
-    ]
-    for scraper in ALL_SCRAPERS:
-        all_offers.extend(await scraper.scrape_all_offers(WINDSURF_SEARCH_URLS))
-
-    dump_json(all_offers, CURRENT_OFFERS_FILE)
-
-    extracted_details = await update_entries_and_fetch_new_offers(all_offers)
+def is_incremental_crawl(database: Database, website: str) -> bool:
+    # The incremental mode never sees all offers, so every FULL_CRAWL_INTERVAL_DAYS the website is crawled completely
+    # to mark the offers which are no longer listed as sold
+    if not INCREMENTAL_CRAWL:
+        return False
+    last_full_crawl = database.last_full_crawl(website)
+    if last_full_crawl is None or datetime.now() - last_full_crawl >= timedelta(days=FULL_CRAWL_INTERVAL_DAYS):
+        print(f'Crawling {website} completely, the last full crawl was on {last_full_crawl}')
+        return False
+    return True
 
-    export_to_excel(load_database(DB_FILE), EXCEL_EXPORT_FILE)
-    print(f'Data saved to: {EXCEL_EXPORT_FILE}')
 
-    print('All new offers:')
-    for entry in extracted_details:
-        print(get_entry_details_readable(entry))
+async def main():
+    from src.config_interests import WINDSURF_SEARCH_URLS
 
-    print('\n' * 10)
+    try:
+        with Database(DATABASE_FILE) as database:
+            database.migrate_from_json(DB_FILE)
+
+            async with HttpClient() as client:
+                ALL_SCRAPERS: list[BaseScraper] = [
+                    # ScraperKleinanzeigen(client, max_pages_to_scrape=25),
+                    # ScraperDailyDose(client, max_pages_to_scrape=10),
+                    ScraperKleinanzeigen(
+                        client,
+                        max_pages_to_scrape=5,
+                        incremental=is_incremental_crawl(database, ScraperKleinanzeigen.base_url),
+                    ),
+                    ScraperDailyDose(
+                        client,
+                        max_pages_to_scrape=5,
+                        incremental=is_incremental_crawl(database, ScraperDailyDose.base_url),
+                    ),
+                ]
+                extracted_details = await scrape_and_process_offers(database, ALL_SCRAPERS, WINDSURF_SEARCH_URLS)
+
+            # Only recomputed and written for entries stored before the INTEREST_LOCATIONS changed
+            all_entries = database.load_entries()
+            updated = update_closest_interest_locations([entry.metadata for entry in all_entries])
+            updated_offer_ids = {metadata.offer.id for metadata in updated}
+            database.upsert_entries([entry for entry in all_entries if entry.metadata.offer.id in updated_offer_ids])
+
+            export_to_excel(all_entries, EXCEL_EXPORT_FILE)
+            print(f'Data saved to: {EXCEL_EXPORT_FILE}')
+
+        print('All new offers:')
+        for entry in extracted_details:
+            print(get_entry_details_readable(entry))
+
+        print('\n' * 10)
+
+        interesting_entries, number_of_interesting_entries = await filter_interesting_entries_using_gpt(
+            extracted_details
+        )
 
-    interesting_entries, number_of_interesting_entries = await filter_interesting_entries_using_gpt(extracted_details)
+        if number_of_interesting_entries:
+            subject = f'New windsurfing offers ({number_of_interesting_entries}) on {date_str()}'
+            text = f'New offers:\n{interesting_entries}'
 
-    if number_of_interesting_entries:
-        subject = f'New windsurfing offers ({number_of_interesting_entries}) on {date_str()}'
-        text = f'New offers:\n{interesting_entries}'
+            print(f'Sending mail with subject: {subject}\nText:\n{text}')
+            send_mail(subject, text, EMAILS_TO_NOTIFY)
+        else:
+            print('No interesting offers found')
 
-        print(f'Sending mail with subject: {subject}\nText:\n{text}')
-        send_mail(subject, text, EMAILS_TO_NOTIFY)
-    else:
-        print('No interesting offers found')
+        print_cache_statistics()
+        print(f'GPT usage: {gpt_token_usage}, waited {gpt_scheduler.waited_seconds:.0f} seconds for the rate limits')
+    finally:
+        flush_caches()
+        await close_gpt_clients()
 
 
 if __name__ == '__main__':
-    import asyncio
-
-    # export_to_excel(load_database(DB_FILE), EXCEL_EXPORT_FILE)
+    # with Database(DATABASE_FILE) as database:
+    #     export_to_excel(database.load_entries(), EXCEL_EXPORT_FILE)
 
     asyncio.run(main())
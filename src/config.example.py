@@ -7,11 +7,21 @@ EMAILS_TO_NOTIFY = ['your-email']  # The email addresses to send notifications t
 
 MAX_NUM_IMAGES = 3
 DO_REQUERY_OLD_OFFERS = False
+# Stop paginating a search URL at the first page which only contains already known offers. Much fewer page fetches,
+# but offers which are no longer listed can only be marked as sold after all pages were crawled, so the websites are
+# still crawled completely every FULL_CRAWL_INTERVAL_DAYS days and sold offers are only detected on those runs
+INCREMENTAL_CRAWL = False
+FULL_CRAWL_INTERVAL_DAYS = 7
 
 
 LLM_MODEL_ID = 'gpt-4o-mini'
+# The rate limits of your OpenAI usage tier, corrected at runtime by the rate limit headers of the responses
+LLM_REQUESTS_PER_MINUTE = 500
+LLM_TOKENS_PER_MINUTE = 200_000
+OPENAI_BASE_URL = None  # None for the OpenAI API, otherwise the URL of an OpenAI compatible API
 
-DB_FILE = 'db.json'
+DATABASE_FILE = 'db.sqlite3'
+DB_FILE = 'db.json'  # Old JSON database, migrated once into DATABASE_FILE
 CURRENT_OFFERS_FILE = 'current_offers.json'
 OFFER_IMAGE_DIR = 'offer_images'
 EXCEL_EXPORT_FILE = 'export.xlsx'
@@ -0,0 +1,431 @@
+import os
+import sqlite3
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Collection, Iterator, Mapping
+
+from src.types import DatabaseFactory, Entry, Offer, User
+from src.util import (
+    custom_asdict,
+    format_timestamp,
+    iter_json_array,
+    json_dumps,
+    json_loads,
+    log_all_exceptions,
+    parse_timestamp,
+    timeblock,
+)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    key INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    rating TEXT NOT NULL,
+    all_offers_link TEXT NOT NULL,
+    UNIQUE (id, name, rating, all_offers_link)
+);
+CREATE TABLE IF NOT EXISTS offers (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    price TEXT NOT NULL,
+    location TEXT NOT NULL,
+    date TEXT NOT NULL,
+    link TEXT NOT NULL,
+    sold INTEGER NOT NULL,
+    image_urls TEXT NOT NULL,
+    scraped_on TEXT NOT NULL,
+    user_key INTEGER NOT NULL REFERENCES users (key)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    offer_id TEXT NOT NULL REFERENCES offers (id),
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    lat REAL NOT NULL,
+    long REAL NOT NULL,
+    data TEXT NOT NULL,
+    closest_location_name TEXT,
+    closest_location_distance REAL,
+    interest_locations_key TEXT,
+    PRIMARY KEY (offer_id, position)
+);
+CREATE INDEX IF NOT EXISTS offers_link ON offers (link);
+CREATE TABLE IF NOT EXISTS full_crawls (
+    website TEXT PRIMARY KEY,
+    crawled_on TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seen_offers (
+    link TEXT PRIMARY KEY,
+    seen_on TEXT NOT NULL
+);
+"""
+
+# Columns added after the first version of the schema, added to existing databases when opened
+ADDED_COLUMNS = {
+    'entries': ['closest_location_name TEXT', 'closest_location_distance REAL', 'interest_locations_key TEXT'],
+}
+
+ENTRY_COLUMNS = (
+    'e.offer_id, e.position, e.type, e.lat, e.long, e.data, '
+    'e.closest_location_name, e.closest_location_distance, e.interest_locations_key'
+)
+OFFER_COLUMNS = (
+    'o.id, o.title, o.description, o.price, o.location, o.date, o.link, o.sold, o.image_urls, o.scraped_on, o.user_key'
+)
+USER_COLUMNS = 'u.id, u.name, u.rating, u.all_offers_link'
+
+
+@dataclass(frozen=True)
+class OfferFingerprint:
+    # The few columns of a stored offer which are needed to partition the current offers and to detect changed cards,
+    # loading these is much cheaper than building the Entry, Offer and User objects
+    id: str
+    link: str
+    title: str
+    price: str
+    sold: bool
+
+
+class Database:
+    """SQLite backed storage of the offers, the entries extracted from them and the users who posted them.
+    Only rows which changed since they were loaded or last written are written again.
+
+    with Database('db.sqlite3') as database:
+        index = database.load_index()  # cheap, by offer id
+        entries = database.load_entries(offer_ids=['123', '456'])  # only the entries which are needed
+        ...
+        database.upsert_entries(entries)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        # Rows as they are stored in the database, to only write rows which changed
+        self._stored_offers: dict[str, tuple] = {}
+        self._stored_entries: dict[tuple[str, int], tuple] = {}
+        self._user_keys: dict[tuple, int] = {}
+
+    def __enter__(self) -> 'Database':
+        dir_name = os.path.dirname(self.path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.executescript(SCHEMA)
+        self._add_missing_columns()
+        return self
+
+    def __exit__(self, *_) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _add_missing_columns(self) -> None:
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row[1] for row in self.connection.execute(f'PRAGMA table_info({table})')}
+            for column in columns:
+                if column.split()[0] not in existing:
+                    self.connection.execute(f'ALTER TABLE {table} ADD COLUMN {column}')
+        self.connection.commit()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        assert self._connection is not None, 'Database must be used as a context manager'
+        return self._connection
+
+    def is_empty(self) -> bool:
+        return self.connection.execute('SELECT 1 FROM offers LIMIT 1').fetchone() is None
+
+    def migrate_from_json(self, json_path: str) -> None:
+        # One-shot migration of the old JSON database, only done while the SQLite database is still empty
+        # The JSON file is parsed incrementally and written in chunks, so the memory usage does not grow with its size
+        if not os.path.exists(json_path) or not self.is_empty():
+            return
+
+        with timeblock(f'migrating {json_path} to {self.path}'):
+            num_entries = 0
+            chunk: list[Entry] = []
+            written_offer_ids: set[str] = set()
+
+            def write_chunk() -> None:
+                # upsert_entries replaces all entries of an offer, so the entries of offers which appear again
+                # later in the file (e.g. re-extracted in a later run) are written together with the earlier ones
+                offer_ids = {entry.metadata.offer.id for entry in chunk}
+                earlier_entries = self.load_entries(offer_ids & written_offer_ids)
+                self.upsert_entries(earlier_entries + chunk)
+                written_offer_ids.update(offer_ids)
+                chunk.clear()
+
+            for entry_json in iter_json_array(json_path):
+                with log_all_exceptions('while parsing database entry'):
+                    entry = DatabaseFactory.parse_entry(entry_json)
+                    if len(chunk) >= 1000 and chunk[-1].metadata.offer.id != entry.metadata.offer.id:
+                        write_chunk()
+                    chunk.append(entry)
+                    num_entries += 1
+            write_chunk()
+            print(f'Migrated {num_entries} entries from {json_path} to {self.path}')
+
+    def load_index(self) -> dict[str, OfferFingerprint]:
+        # Fingerprints of all stored offers by their id, without building any Entry or Offer objects
+        return {
+            row[0]: OfferFingerprint(row[0], row[1], row[2], row[3], bool(row[4]))
+            for row in self.connection.execute('SELECT id, link, title, price, sold FROM offers')
+        }
+
+    def load_entries(self, offer_ids: Collection[str] | None = None) -> list[Entry]:
+        # All entries, or only the entries of the given offers, in the order in which they were stored
+        return list(self.iter_entries(offer_ids))
+
+    def iter_entries(self, offer_ids: Collection[str] | None = None) -> Iterator[Entry]:
+        # Materialize the entries one by one while the rows are streamed from the database
+        # The entries of one offer share the same Offer object and all offers of a user share the same User object
+        if offer_ids is None:
+            yield from self._iter_entries('', ())
+            return
+
+        offer_ids = sorted(offer_ids)
+        for start in range(0, len(offer_ids), 500):  # SQLite limits the number of parameters of a query
+            chunk = offer_ids[start : start + 500]
+            yield from self._iter_entries(f'WHERE e.offer_id IN ({", ".join("?" * len(chunk))})', chunk)
+
+    def load_offer(self, offer_id: str) -> Offer | None:
+        row = self.connection.execute(
+            f'SELECT {OFFER_COLUMNS}, {USER_COLUMNS} FROM offers o JOIN users u ON u.key = o.user_key WHERE o.id = ?',
+            (offer_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return self._offer_from_row(row[:11], self._user_from_row(row[10], row[11:]))
+
+    def mark_sold(self, offer_ids: Collection[str]) -> None:
+        # Mark the offers as sold without loading them, only offers which were not sold yet are written
+        with self.connection:
+            cursor = self.connection.executemany(
+                'UPDATE offers SET sold = 1 WHERE id = ? AND sold = 0', ((offer_id,) for offer_id in offer_ids)
+            )
+        for offer_id in offer_ids:
+            self._stored_offers.pop(offer_id, None)
+        print(f'Marked {cursor.rowcount} offers as sold in {self.path}')
+
+    def last_full_crawl(self, website: str) -> datetime | None:
+        # When all pages of the website were last crawled, i.e. absent offers could be marked as sold
+        row = self.connection.execute('SELECT crawled_on FROM full_crawls WHERE website = ?', (website,)).fetchone()
+        crawled_on = parse_timestamp(row[0]) if row is not None else None
+        return crawled_on if isinstance(crawled_on, datetime) else None
+
+    def record_full_crawl(self, website: str, crawled_on: datetime) -> None:
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO full_crawls (website, crawled_on) VALUES (?, ?)',
+                (website, format_timestamp(crawled_on)),
+            )
+
+    def load_seen_offer_links(self) -> set[str]:
+        # Links of all offers seen on a search page, including the offers which were filtered out and never stored
+        return {row[0] for row in self.connection.execute('SELECT link FROM seen_offers')}
+
+    def record_seen_offers(self, links: Collection[str], seen_on: datetime) -> None:
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO seen_offers (link, seen_on) VALUES (?, ?)',
+                ((link, format_timestamp(seen_on)) for link in links),
+            )
+
+    def _iter_entries(self, where: str, parameters: Collection[str]) -> Iterator[Entry]:
+        users: dict[int, User] = {}
+        offer: Offer | None = None
+
+        for row in self.connection.execute(
+            f'SELECT {ENTRY_COLUMNS}, {OFFER_COLUMNS}, {USER_COLUMNS} '
+            'FROM entries e JOIN offers o ON o.id = e.offer_id JOIN users u ON u.key = o.user_key '
+            f'{where} ORDER BY e.offer_id, e.position',
+            tuple(parameters),
+        ):
+            entry_row, offer_row, user_row = row[:9], row[9:20], row[20:]
+            offer_id, position, entry_type, lat, long, data, *closest_interest_location = entry_row
+
+            entry: Entry | None = None
+            with log_all_exceptions(f'while parsing the entry {position} of offer {offer_id}'):
+                if offer is None or offer.id != offer_id:
+                    user_key = offer_row[10]
+                    if user_key not in users:
+                        users[user_key] = self._user_from_row(user_key, user_row)
+                    offer = self._offer_from_row(offer_row, users[user_key])
+
+                entry = DatabaseFactory.parse_parial_entry({'type': entry_type, **json_loads(data)}, offer, (lat, long))
+                (
+                    entry.metadata.closest_location_name,
+                    entry.metadata.closest_location_distance,
+                    entry.metadata.interest_locations_key,
+                ) = closest_interest_location
+                self._stored_entries[(offer_id, position)] = entry_row
+
+            if entry is not None:
+                yield entry
+
+    def _user_from_row(self, key: int, user_row: tuple) -> User:
+        self._user_keys[tuple(user_row)] = key
+        return User(*user_row)
+
+    def _offer_from_row(self, row: tuple, user: User) -> Offer:
+        self._stored_offers[row[0]] = row
+        offer_id, title, description, price, location, date, link, sold, image_urls, scraped_on, _ = row
+        return Offer(
+            id=offer_id,
+            title=title,
+            description=description,
+            price=price,
+            location=sys.intern(location),
+            date=sys.intern(date),
+            link=link,
+            sold=bool(sold),
+            image_urls=json_loads(image_urls),
+            scraped_on=parse_timestamp(scraped_on),
+            user=user,
+        )
+
+    def upsert_entries(self, entries: list[Entry]) -> None:
+        # Insert new and update changed offers, users and entries, unchanged rows are not written
+        # The entries must contain all entries of each of their offers, stored entries of an offer beyond them are deleted
+        entries_by_offer: dict[str, list[Entry]] = {}
+        for entry in entries:
+            entries_by_offer.setdefault(entry.metadata.offer.id, []).append(entry)
+
+        offer_rows: list[tuple] = []
+        entry_rows: list[tuple] = []
+
+        with self.connection:
+            for offer_id, offer_entries in entries_by_offer.items():
+                # The entries of an offer can come from different scrapes of it, the latest one is stored
+                offer_row = self._offer_row(offer_entries[-1].metadata.offer)
+                if self._stored_offers.get(offer_id) != offer_row:
+                    offer_rows.append(offer_row)
+                    self._stored_offers[offer_id] = offer_row
+
+                for position, entry in enumerate(offer_entries):
+                    entry_row = self._entry_row(entry, position)
+                    if self._stored_entries.get((offer_id, position)) != entry_row:
+                        entry_rows.append(entry_row)
+                        self._stored_entries[(offer_id, position)] = entry_row
+
+                position = len(offer_entries)
+                while self._stored_entries.pop((offer_id, position), None) is not None:
+                    position += 1
+
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO offers '
+                '(id, title, description, price, location, date, link, sold, image_urls, scraped_on, user_key) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                offer_rows,
+            )
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO entries (offer_id, position, type, lat, long, data, '
+                'closest_location_name, closest_location_distance, interest_locations_key) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                entry_rows,
+            )
+            # E.g. a re-extraction of the offer which returned fewer entries than before
+            self.connection.executemany(
+                'DELETE FROM entries WHERE offer_id = ? AND position >= ?',
+                ((offer_id, len(offer_entries)) for offer_id, offer_entries in entries_by_offer.items()),
+            )
+
+        print(f'Wrote {len(offer_rows)} changed offers and {len(entry_rows)} changed entries to {self.path}')
+
+    def _user_key(self, user: User) -> int:
+        user_row = (user.id, user.name, user.rating, user.all_offers_link)
+        if user_row not in self._user_keys:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO users (id, name, rating, all_offers_link) VALUES (?, ?, ?, ?)', user_row
+            )
+            (key,) = self.connection.execute(
+                'SELECT key FROM users WHERE id = ? AND name = ? AND rating = ? AND all_offers_link = ?', user_row
+            ).fetchone()
+            self._user_keys[user_row] = key
+        return self._user_keys[user_row]
+
+    def _offer_row(self, offer: Offer) -> tuple:
+        return (
+            offer.id,
+            offer.title,
+            offer.description,
+            offer.price,
+            offer.location,
+            offer.date,
+            offer.link,
+            int(offer.sold),
+            json_dumps(list(offer.image_urls)),
+            format_timestamp(offer.scraped_on),
+            self._user_key(offer.user),
+        )
+
+    @staticmethod
+    def _entry_row(entry: Entry, position: int) -> tuple:
+        lat, long = entry.metadata.lat_long
+        return (
+            entry.metadata.offer.id,
+            position,
+            entry.metadata.type,
+            lat,
+            long,
+            json_dumps(_without_metadata(custom_asdict(entry))),
+            entry.metadata.closest_location_name,
+            entry.metadata.closest_location_distance,
+            entry.metadata.interest_locations_key,
+        )
+
+
+def _without_metadata(data: Any) -> Any:
+    # The metadata is stored in the offers table, nested entries (e.g. of a full rig) carry a copy of it as well
+    if isinstance(data, dict):
+        return {key: _without_metadata(value) for key, value in data.items() if key != 'metadata'}
+    return data
+
+
+class KnownOffers(Mapping[str, Offer]):
+    """The stored offers by their link, an offer is only loaded from the database once it is accessed.
+    Checking whether a link is known only uses the index."""
+
+    def __init__(self, database: Database, index: dict[str, OfferFingerprint]):
+        self.database = database
+        self.offer_ids = {fingerprint.link: offer_id for offer_id, fingerprint in index.items()}
+
+    def __getitem__(self, link: str) -> Offer:
+        offer = self.database.load_offer(self.offer_ids[link])
+        if offer is None:
+            raise KeyError(link)
+        return offer
+
+    def __contains__(self, link: object) -> bool:
+        return link in self.offer_ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.offer_ids)
+
+    def __len__(self) -> int:
+        return len(self.offer_ids)
+
+
+class SeenOffers:
+    """The links of all offers seen on a search page, including the offers which were filtered out before they were
+    stored. Newly seen links are written to the database right away."""
+
+    def __init__(self, database: Database):
+        self.database = database
+        self.links = database.load_seen_offer_links()
+
+    def __contains__(self, link: object) -> bool:
+        return link in self.links
+
+    def __len__(self) -> int:
+        return len(self.links)
+
+    def update(self, links: Collection[str]) -> None:
+        new_links = [link for link in links if link not in self.links]
+        if new_links:
+            self.database.record_seen_offers(new_links, datetime.now())
+            self.links.update(new_links)
@@ -1,13 +1,18 @@
+from datetime import datetime
+
 from openpyxl import Workbook
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.styles import Font
 
 
-from src.types import Entry, Uninteresting, list_entries_of_type
+from src.types import Entry, Uninteresting, list_entries_of_type, update_closest_interest_locations
 from src.types_to_search import ALL_TYPES
 
 
 def export_to_excel(entries: list[Entry], path: str) -> None:
+    # The closest interest location of every entry is exported, compute the missing ones in one go
+    update_closest_interest_locations([entry.metadata for entry in entries])
+
     wb = Workbook()
     # Remove the default sheet
     if wb.active:
@@ -15,8 +20,7 @@ def export_to_excel(entries: list[Entry], path: str) -> None:
 
     for type_ in [Uninteresting] + list(reversed(ALL_TYPES)):
         entries_of_type = list_entries_of_type(entries, type_)
-        scraped_on_dict = {entry.metadata.offer.link: entry.to_excel()['Scraped on'].value for entry in entries_of_type}
-        entries_of_type.sort(key=lambda entry: scraped_on_dict[entry.metadata.offer.link], reverse=True)
+        entries_of_type.sort(key=scraped_on_sort_key, reverse=True)
         if entries_of_type:
             ws: Worksheet = wb.create_sheet(type_.__name__, 0)
             add_entries_to_worksheet(ws, entries_of_type)
@@ -25,6 +29,12 @@ def export_to_excel(entries: list[Entry], path: str) -> None:
     wb.save(path)
 
 
+def scraped_on_sort_key(entry: Entry) -> datetime:
+    # Offers with an unparseable timestamp are sorted last
+    scraped_on = entry.metadata.offer.scraped_on
+    return scraped_on if isinstance(scraped_on, datetime) else datetime.min
+
+
 def add_entries_to_worksheet(ws: Worksheet, entries: list[Entry]) -> None:
     assert len(entries) > 0, 'We need at least one entry to create an Excel sheet'
 
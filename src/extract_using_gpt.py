@@ -1,13 +1,20 @@
 import json
 import base64
+import hashlib
+from functools import cache
 
 
-from src.config import MAX_NUM_IMAGES, OFFER_IMAGE_DIR
+from src.config import LLM_MODEL_ID, MAX_NUM_IMAGES, OFFER_IMAGE_DIR
 from src.types_to_search import ALL_TYPES
 from src.types import DatabaseFactory, Entry, Offer, Uninteresting, to_readable_name
 from src.util import async_gpt_request
 
 
+# Part of the cache key of the extraction requests instead of the prompt itself.
+# Increase it when the prompt or the types to search change, so that the offers are extracted again.
+EXTRACTION_PROMPT_VERSION = 1
+
+
 def base64_encode_image(image: bytes) -> str:
     return base64.b64encode(image).decode('utf-8')
 
@@ -18,13 +25,13 @@ def get_example_image() -> str:
         return base64_encode_image(file.read())
 
 
-def load_and_convert_images_to_base64(offer_id: str, max_num_images: int) -> list[str]:
-    base64_images: list[str] = []
+def load_images(offer_id: str, max_num_images: int) -> list[bytes]:
+    images: list[bytes] = []
 
     for i in range(max_num_images):
         try:
             with open(f'{OFFER_IMAGE_DIR}/{offer_id}/{i}.jpg', 'rb') as file:
-                base64_images.append(base64_encode_image(file.read()))
+                images.append(file.read())
         except FileNotFoundError:
             # Assuming, that this offer did contain less than max_num_images images
             break
@@ -32,7 +39,7 @@ def load_and_convert_images_to_base64(offer_id: str, max_num_images: int) -> lis
             print(f'Failed to read image file: {e}')
             break
 
-    return base64_images
+    return images
 
 
 def get_type_descriptions() -> str:
@@ -53,11 +60,19 @@ You should output the information in the following JSON format based on the type
 {all_type_descriptions}"""
 
 
-def get_extraction_prompt(offer: Offer):
+def get_extraction_cache_key(offer: Offer, images: list[bytes]) -> tuple:
+    # Everything the extraction depends on, with the images by their content digest instead of their base64 encoding
+    image_digests = [hashlib.sha256(image).hexdigest() for image in images]
+    return LLM_MODEL_ID, EXTRACTION_PROMPT_VERSION, offer.title, offer.description, image_digests
+
+
+@cache
+def get_extraction_prompt_prefix() -> tuple[dict, ...]:
+    # The system prompt and the example are the same for every offer, so they are built once per process
+    # They are sent byte-identical in front of the offer, so that the prompt cache of the provider can be used for them
     base64_example_image = get_example_image()
-    base64_images = load_and_convert_images_to_base64(offer.id, MAX_NUM_IMAGES)
 
-    return [
+    return (
         {
             'role': 'system',
             'content': f"""You are a helpful assistant that extracts information from offers related to Windsurf equipment and converts it into a specific JSON format. {get_type_descriptions()}
@@ -106,6 +121,14 @@ Description: Segel mit wenigen Gebrauchsspuren. 2 Band-Camber als Profilgeber. E
   "state": "repaired"
 }""",
         },
+    )
+
+
+def get_extraction_prompt(offer: Offer, images: list[bytes]):
+    base64_images = [base64_encode_image(image) for image in images]
+
+    return [
+        *get_extraction_prompt_prefix(),
         {
             'role': 'user',
             'content': [
@@ -129,7 +152,12 @@ Description: {offer.description}""",
 
 
 async def extract_offer_details(offer: Offer, lat_long: tuple[float, float]) -> list[Entry]:
-    success, res = await async_gpt_request(get_extraction_prompt(offer), response_format={'type': 'json_object'})
+    images = load_images(offer.id, MAX_NUM_IMAGES)
+    success, res = await async_gpt_request(
+        lambda: get_extraction_prompt(offer, images),  # only encoded if the response is not cached
+        response_format={'type': 'json_object'},
+        cache_key=get_extraction_cache_key(offer, images),
+    )
 
     if not success:
         print(f'Failed to get the response for offer: {offer.title} ({offer.link}): {res}')
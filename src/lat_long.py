@@ -1,25 +1,44 @@
+import os
 import re
 import json
 import math
+import hashlib
 from functools import cache
+from typing import Sequence
 
 import urllib
 import urllib.parse
 
+import numpy as np
+
 from src.config import GEOAPIFY_API_KEY
 from src.util import cache_to_folder, get
 
+# File is from: https://github.com/WZBSocialScienceCenter/plz_geocoord
+PLZ_GEOCOORD_FILE = 'data/plz_geocoord.csv'
+# Precompiled index of the file, built on first use and memory-mapped afterwards
+PLZ_INDEX_FILE = 'data/plz_geocoord.npy'
+# Precomputed postal codes within the radius of the INTEREST_LOCATIONS, rebuilt when these change
+PLZ_COVERAGE_FILE = 'data/plz_coverage.npz'
+
+
+class UnknownPLZError(LookupError):
+    """The postal code is not in the PLZ_GEOCOORD_FILE."""
+
 
 async def extract_lat_long(location: str) -> tuple[float, float]:
     """Extract the latitude and longitude from the location.
-    The location will be searched for a postal code. If a postal code is found, the latitude and longitude will be extracted from a file.
-    If no postal code is found, the location will be queried using an API to get the latitude and longitude.
+    The location will be searched for a postal code. If a known postal code is found, the latitude and longitude will be extracted from a file.
+    Otherwise the location will be queried using an API to get the latitude and longitude.
     If the location is not found in the API, the default value (0, 0) will be returned."""
     if plz := extract_plz(location):
-        return plz_to_lat_long(plz)
-    else:
-        # not all offers (from dailydose.de) have a plz in the location
-        return await query_api_for_lat_lon(location)
+        try:
+            return plz_to_lat_long(plz)
+        except UnknownPLZError:
+            print(f'Unknown postal code {plz}, querying the location instead: {location}')
+
+    # not all offers (from dailydose.de) have a plz in the location
+    return await query_api_for_lat_lon(location)
 
 
 def extract_plz(data: str) -> int | None:
@@ -30,21 +49,140 @@ def extract_plz(data: str) -> int | None:
     return int(res.group())
 
 
-@cache
 def plz_to_lat_long(plz: int) -> tuple[float, float]:
-    """Convert the postal code to latitude and longitude."""
-    # load the data/plz_geocoord.csv file
-    # File is from: https://github.com/WZBSocialScienceCenter/plz_geocoord
-    with open('data/plz_geocoord.csv', 'r') as file:
-        lines = file.readlines()[1:]
+    """Convert the postal code to latitude and longitude.
+    Raises an UnknownPLZError if the postal code is not in the PLZ_GEOCOORD_FILE."""
+    if not is_known_plz(plz):
+        raise UnknownPLZError(f'Unknown postal code: {plz}')
+    lat, long = plz_index()[plz]
+    return float(lat), float(long)
+
+
+def is_known_plz(plz: int) -> bool:
+    index = plz_index()
+    return 0 <= plz < len(index) and not np.isnan(index[plz, 0])
+
+
+@cache
+def plz_index() -> np.ndarray:
+    """Latitude and longitude of all postal codes as an array indexed by the postal code, NaN for unknown postal codes."""
+    is_compiled = os.path.exists(PLZ_INDEX_FILE) and os.path.getmtime(PLZ_INDEX_FILE) >= os.path.getmtime(
+        PLZ_GEOCOORD_FILE
+    )
+    if is_compiled:
+        return np.load(PLZ_INDEX_FILE, mmap_mode='r')
+
+    index = np.full((100_000, 2), np.nan)
+    with open(PLZ_GEOCOORD_FILE, 'r') as file:
+        next(file)  # skip the header
+        for line in file:
+            plz, lat, long = line.split(',')
+            index[int(plz)] = float(lat), float(long)
+
+    try:
+        np.save(PLZ_INDEX_FILE, index)
+    except OSError as e:
+        print(f'Failed to save the postal code index to {PLZ_INDEX_FILE}: {e}')
+    return index
+
+
+def is_in_interest_locations(lat_long: tuple[float, float]) -> bool:
+    """Check if the point is within the radius of any of the interest locations."""
+    return bool(are_in_interest_locations([lat_long])[0])
+
+
+def are_in_interest_locations(lat_longs: Sequence[tuple[float, float]]) -> np.ndarray:
+    """Check for each point if it is within the radius of any of the interest locations, computed in one go."""
+    _, interest_lat_longs, radii = interest_locations()
+    return (distance_matrix(np.asarray(lat_longs, dtype=float), interest_lat_longs) < radii).any(axis=1)
+
+
+def closest_interest_locations(lat_longs: Sequence[tuple[float, float]]) -> tuple[list[str], np.ndarray]:
+    """Names of and distances to the closest interest location of all points, computed in one go."""
+    names, interest_lat_longs, _ = interest_locations()
+    if not lat_longs:
+        return [], np.empty(0)
+
+    distances = distance_matrix(np.asarray(lat_longs, dtype=float), interest_lat_longs)
+    closest = distances.argmin(axis=1)
+    closest_names = [names[index] for index in closest]
+    closest_distances = distances[np.arange(len(lat_longs)), closest]
+    return closest_names, closest_distances
+
 
-    # find the line with the postal code
-    for line in lines:
-        line_plz, lat, long = line.split(',')
-        if int(line_plz) == plz:
-            return float(lat), float(long)
+def distances_to_interest_locations(lat_long: tuple[float, float]) -> dict[str, float]:
+    """Distance of the point to each of the interest locations by their name."""
+    names, interest_lat_longs, _ = interest_locations()
+    distances = distance_matrix(np.asarray([lat_long], dtype=float), interest_lat_longs)[0]
+    return {name: float(distance) for name, distance in zip(names, distances)}
 
-    return 0, 0  # return a default value which is far away from any location, so that the offer is not considered
+
+@cache
+def interest_locations() -> tuple[list[str], np.ndarray, np.ndarray]:
+    """Names, coordinates (lat, long) and radii of the INTEREST_LOCATIONS.
+    Sorted by name, so that the first of equally distant locations is the same as before."""
+    from src.config_interests import INTEREST_LOCATIONS
+
+    locations = sorted(INTEREST_LOCATIONS, key=lambda location: location[2])
+    names = [name for _, _, name in locations]
+    lat_longs = np.array([plz_to_lat_long(plz) for plz, _, _ in locations], dtype=float).reshape(-1, 2)
+    radii = np.array([radius for _, radius, _ in locations], dtype=float)
+    return names, lat_longs, radii
+
+
+def is_plz_in_interest_locations(plz: int) -> bool:
+    """Check if the postal code is within the radius of any of the interest locations, a set lookup.
+    Unknown postal codes are never within the radius, use is_known_plz to tell them apart."""
+    return plz in plz_coverage()
+
+
+@cache
+def plz_coverage() -> frozenset[int]:
+    """The postal codes within the radius of the interest locations.
+    Loaded from the PLZ_COVERAGE_FILE if it was built for the current INTEREST_LOCATIONS, otherwise built and saved."""
+    key = interest_locations_key()
+    is_up_to_date = os.path.exists(PLZ_COVERAGE_FILE) and os.path.getmtime(PLZ_COVERAGE_FILE) >= os.path.getmtime(
+        PLZ_GEOCOORD_FILE
+    )
+    if is_up_to_date:
+        with np.load(PLZ_COVERAGE_FILE) as data:
+            if str(data['key']) == key:
+                return frozenset(np.flatnonzero(data['in_range']).tolist())
+
+    # All postal code centroids against all interest locations, a few thousand times a few locations
+    index = plz_index()
+    _, interest_lat_longs, radii = interest_locations()
+    known_plzs = np.flatnonzero(~np.isnan(index[:, 0]))
+    distances = distance_matrix(np.asarray(index[known_plzs]), interest_lat_longs)
+
+    in_range = np.zeros(len(index), dtype=bool)
+    in_range[known_plzs] = (distances < radii).any(axis=1)
+
+    try:
+        np.savez(PLZ_COVERAGE_FILE, key=np.array(key), in_range=in_range)
+    except OSError as e:
+        print(f'Failed to save the postal code coverage to {PLZ_COVERAGE_FILE}: {e}')
+
+    return frozenset(np.flatnonzero(in_range).tolist())
+
+
+@cache
+def interest_locations_key() -> str:
+    """Hash of the INTEREST_LOCATIONS, results which depend on them are invalid once the hash changes."""
+    from src.config_interests import INTEREST_LOCATIONS
+
+    return hashlib.sha256(json.dumps(INTEREST_LOCATIONS).encode()).hexdigest()
+
+
+def distance_matrix(lat_longs1: np.ndarray, lat_longs2: np.ndarray) -> np.ndarray:
+    """Calculate the distances in kilometers between all points of lat_longs1 (N x 2) and lat_longs2 (M x 2) as N x M matrix."""
+    radius = 6371  # km
+
+    lat1, lng1 = np.radians(lat_longs1[:, 0])[:, None], np.radians(lat_longs1[:, 1])[:, None]
+    lat2, lng2 = np.radians(lat_longs2[:, 0])[None, :], np.radians(lat_longs2[:, 1])[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return radius * c
 
 
 def distance(lat_lng1: tuple[float, float], lat_lng2: tuple[float, float]) -> float:
@@ -62,7 +200,7 @@ def distance(lat_lng1: tuple[float, float], lat_lng2: tuple[float, float]) -> fl
     return radius * c
 
 
-@cache_to_folder('data/lat_lon_cache')
+@cache_to_folder('data/lat_lon_cache', ttl=365 * 24 * 60 * 60)  # places rarely move
 async def query_api_for_lat_lon(location: str) -> tuple[float, float]:
     """Query an API to get the latitude and longitude of the location."""
     url_encoded_parameters = urllib.parse.urlencode(
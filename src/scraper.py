@@ -1,20 +1,47 @@
 import os
-import asyncio
 
 from abc import abstractmethod
-from typing import Optional
+from contextlib import aclosing
+from dataclasses import replace
+from datetime import datetime
+from typing import AsyncIterator, Mapping, Optional
+from urllib.parse import urlparse
+
+from tqdm import tqdm
 
 from src.config import OFFER_IMAGE_DIR
-from src.types import Offer
-from src.util import timeblock, get_bytes, run_in_batches
-from src.util.requests import GETError
+from src.database import SeenOffers
+from src.lat_long import extract_plz, is_known_plz, is_plz_in_interest_locations
+from src.types import Offer, OfferStub
+from src.util import timeblock, get_bytes, run_in_batches, stream_in_window, stream_pipeline, Stage
+from src.util.requests import GETError, HttpClient, PermanentGETError
 
 
 class BaseScraper:
-    def __init__(self, offer_page_batch_size: int, max_offers_per_page: int, max_pages_to_scrape: int):
-        self.offer_page_batch_size = offer_page_batch_size
-        self.max_offers_per_page = max_offers_per_page
+    # Settings of the scraped website, to be overridden by the subclasses
+    base_url: str  # All requests to the host of this URL share the rate limit below
+    max_offers_per_page: int  # Number of offers on a full search page
+    offer_page_batch_size: int = 10  # Maximum number of pages fetched concurrently
+    requests_per_second: float = 2.0  # Politeness limit of the website, enforced by the HttpClient
+    burst: int = 5  # Number of requests which may be sent at once before the rate limit kicks in
+    search_results_newest_first: bool = False  # Required for the incremental mode
+
+    def __init__(self, client: HttpClient, max_pages_to_scrape: int = 1000, incremental: bool = False):
+        self.client = client
         self.max_pages_to_scrape = max_pages_to_scrape
+        # In incremental mode the pagination of a search URL stops at the first page which only contains known offers
+        self.incremental = incremental and self.search_results_newest_first
+        self.known_offers: Mapping[str, Offer] = {}  # Offers of the database by their link
+        self.known_offer_links: set[str] = set()  # Offers of the database and offers seen earlier in this run
+        self.seen_offers: SeenOffers | None = None  # Offers seen in earlier runs, also the ones which were filtered out
+        self.skipped_offer_page_fetches = 0  # Known offers whose card on the search page did not change
+        self.prefiltered_offers = 0  # New offers whose card shows a postal code outside of the interest locations
+        self.is_crawl_complete = True  # False if the incremental mode skipped pages, so absent offers are not sold
+        self.client.set_rate_limit(urlparse(self.base_url).netloc, self.requests_per_second, self.burst)
+
+    @property
+    def name(self) -> str:
+        return type(self).__name__.removeprefix('Scraper')
 
     @abstractmethod
     def filter_relevant_urls(self, urls: list[str]) -> list[str]:
@@ -31,107 +58,165 @@ class BaseScraper:
         # Scrape the links to all offers from the provided search URL
         ...
 
+    async def scrape_offer_stubs_from_search_url(self, base_url: str) -> list[OfferStub | None]:
+        # Scrape the cards of all offers from the provided search URL
+        # Override this if the search page shows the title and price of the offers, so that the offer pages
+        # of unchanged known offers do not have to be fetched again
+        return [
+            OfferStub(link=link) if link is not None else None
+            for link in await self.scrape_offer_links_from_search_url(base_url)
+        ]
+
     async def scrape_all_offers(self, search_urls: list[str]) -> list[Offer]:
-        with timeblock('scraping all offer links'):
-            all_offer_links_list: list[list[str] | None] = await run_in_batches(
-                self.filter_relevant_urls(search_urls),
-                self.offer_page_batch_size,
-                self._scrape_all_offer_links_from_search_url,
-                desc='Scraping offer links',
-            )
-        all_offer_links = list(
-            set().union(
-                link
-                for list in all_offer_links_list
-                if list is not None
-                for link in list
-                if link is not None and link != ''
-            )
+        with timeblock(f'scraping all {self.name} offers'):
+            return [offer async for offer in self.stream_all_offers(search_urls)]
+
+    async def stream_all_offers(
+        self,
+        search_urls: list[str],
+        known_offers: Mapping[str, Offer] | None = None,
+        seen_offers: SeenOffers | None = None,
+    ) -> AsyncIterator[Offer]:
+        # Yield the offers as soon as they are scraped, the offer pages of a search URL are already fetched
+        # while the other search URLs are still being paginated
+        # The known offers (e.g. of the database, by their link) are not fetched again if their card did not change
+        # and are used by the incremental mode to stop paginating early, together with the seen offers, so that
+        # offers which are never stored (e.g. filtered out by their keywords or location) count as known as well
+        self.known_offers = known_offers or {}
+        self.seen_offers = seen_offers
+        self.known_offer_links = set(self.known_offers)
+        self.skipped_offer_page_fetches = 0
+        self.prefiltered_offers = 0
+        self.is_crawl_complete = True
+
+        async def unique_offer_stubs() -> AsyncIterator[OfferStub]:
+            seen_offer_links: set[str] = set()
+            search_urls_of_scraper = self.filter_relevant_urls(search_urls)
+            progress = tqdm(total=len(search_urls_of_scraper), desc=f'Scraping {self.name} offer links', unit='url')
+
+            async with aclosing(
+                stream_in_window(
+                    search_urls_of_scraper,
+                    self.offer_page_batch_size,
+                    self._scrape_all_offer_stubs_from_search_url,
+                )
+            ) as stream:
+                async for _, offer_stubs in stream:
+                    progress.update()
+                    if self.seen_offers is not None:
+                        self.seen_offers.update([stub.link for stub in offer_stubs or [] if stub.link])
+                    for stub in offer_stubs or []:
+                        if stub.link and stub.link not in seen_offer_links:
+                            seen_offer_links.add(stub.link)
+                            if self._is_outside_of_interest_locations(stub):
+                                self.prefiltered_offers += 1
+                                continue
+                            yield stub
+            progress.close()
+
+        async for offer in stream_pipeline(
+            unique_offer_stubs(),
+            [Stage(f'{self.name} offer pages', self._scrape_offer, concurrency=self.offer_page_batch_size)],
+        ):
+            yield offer
+
+        print(
+            f'Saved {self.skipped_offer_page_fetches + self.prefiltered_offers} {self.name} offer page fetches: '
+            f'{self.skipped_offer_page_fetches} unchanged known offers, '
+            f'{self.prefiltered_offers} offers outside of the interest locations'
         )
 
-        with timeblock(f'scraping all {len(all_offer_links)} offers'):
-            return await self._scrape_all_offers_from_offer_links(all_offer_links)
-
     @staticmethod
-    async def scrape_offer_images(offers: list[Offer], offer_page_batch_size: int) -> None:
+    async def scrape_offer_images(offer: Offer) -> None:
         return  # TODO for now, we don't want to scrape images
 
-        async def _scrape_offer_images(offer: Offer) -> None:
-            offer_folder = f'{OFFER_IMAGE_DIR}/{offer.id}/'
+        offer_folder = f'{OFFER_IMAGE_DIR}/{offer.id}/'
 
-            if os.path.exists(offer_folder):
-                return
+        if os.path.exists(offer_folder):
+            return
 
-            os.makedirs(offer_folder, exist_ok=True)
+        os.makedirs(offer_folder, exist_ok=True)
 
-            for idx, image_url in enumerate(offer.image_urls):
-                image_bytes = await get_bytes(image_url)
-                with open(offer_folder + f'{idx}.jpg', 'wb') as file:
-                    file.write(image_bytes)
+        for idx, image_url in enumerate(offer.image_urls):
+            image_bytes = await get_bytes(image_url)
+            with open(offer_folder + f'{idx}.jpg', 'wb') as file:
+                file.write(image_bytes)
 
-        await run_in_batches(
-            offers,
-            offer_page_batch_size,
-            _scrape_offer_images,
-            desc='Scraping offer images',
-        )
-
-    async def _scrape_all_offer_links_from_search_url(self, search_url: str) -> list[str]:
-        all_offer_links: set[str] = set()
+    async def _scrape_all_offer_stubs_from_search_url(self, search_url: str) -> list[OfferStub]:
+        all_offer_stubs: dict[str, OfferStub] = {}
         filtered_out_urls: int = 0
 
-        async def after_batch(urls: list[list[str | None] | None]) -> bool:
-            nonlocal filtered_out_urls, all_offer_links
+        async def after_batch(stub_lists: list[list[OfferStub | None] | None]) -> bool:
+            nonlocal filtered_out_urls, all_offer_stubs
 
-            for url_list in urls:
-                if url_list is not None:
-                    all_offer_links.update([url for url in url_list if url is not None])
-                    filtered_out_urls += sum(1 for url in url_list if url is None)
+            for stub_list in stub_lists:
+                if stub_list is not None:
+                    all_offer_stubs.update({stub.link: stub for stub in stub_list if stub is not None})
+                    filtered_out_urls += sum(1 for stub in stub_list if stub is None)
 
-            should_continue = (len(all_offer_links) + filtered_out_urls) % self.max_offers_per_page == 0
+            should_continue = (len(all_offer_stubs) + filtered_out_urls) % self.max_offers_per_page == 0
 
             if not should_continue:
-                print(f'Filtered out {filtered_out_urls} URLs from {len(all_offer_links)} total URLs.')
+                print(f'Filtered out {filtered_out_urls} URLs from {len(all_offer_stubs)} total URLs.')
+                return False
 
-            return should_continue
+            if self.incremental and any(self._contains_only_known_offers(stub_list) for stub_list in stub_lists):
+                print(f'Stopped paginating {search_url} at a page with only known offers.')
+                self.is_crawl_complete = False
+                return False
 
-        async def scrape_offer_links_from_search_url(page: int) -> list[str | None]:
+            for stub_list in stub_lists:
+                self.known_offer_links.update(stub.link for stub in stub_list or [] if stub is not None)
+
+            return True
+
+        async def scrape_offer_stubs_from_search_url(page: int) -> list[OfferStub | None]:
             try:
-                return await self.scrape_offer_links_from_search_url(search_url.format(page))
+                return await self.scrape_offer_stubs_from_search_url(search_url.format(page))
             except GETError:
                 print(f'Failed to scrape search URL: {search_url.format(page)}')
                 return []
 
+        # In incremental mode the pages are fetched one after another, so that the pagination stops right at the
+        # first page with only known offers instead of after a whole batch of pages has been fetched
         await run_in_batches(
             list(range(1, self.max_pages_to_scrape)),
-            self.offer_page_batch_size,
-            scrape_offer_links_from_search_url,
+            1 if self.incremental else self.offer_page_batch_size,
+            scrape_offer_stubs_from_search_url,
             desc=None,
             after_batch=after_batch,
         )
 
-        return list(all_offer_links)
-
-    async def _scrape_all_offers_from_offer_links(self, all_offer_links: list[str]) -> list[Offer]:
-        async def after_batch(_: list[Offer | None]) -> bool:
-            await asyncio.sleep(1)
-            return True
-
-        async def scrape_offer_url(offer_url: str) -> Optional[Offer]:
-            try:
-                return await self.scrape_offer_url(offer_url)
-            except GETError:
-                print(f'Failed to scrape offer URL: {offer_url}')
-                return None
-
-        return [
-            offer
-            for offer in await run_in_batches(
-                all_offer_links,
-                self.offer_page_batch_size,
-                scrape_offer_url,
-                desc='Scraping offers',
-                after_batch=after_batch,
-            )
-            if offer is not None
-        ]
+        return list(all_offer_stubs.values())
+
+    def _contains_only_known_offers(self, stub_list: list[OfferStub | None] | None) -> bool:
+        offer_links = [stub.link for stub in stub_list or [] if stub is not None]
+        return bool(offer_links) and all(self._is_known_offer_link(link) for link in offer_links)
+
+    def _is_known_offer_link(self, link: str) -> bool:
+        return link in self.known_offer_links or (self.seen_offers is not None and link in self.seen_offers)
+
+    def _is_outside_of_interest_locations(self, stub: OfferStub) -> bool:
+        # Decided on the postal code shown on the card, offers without one are located after fetching their page
+        # Known offers are always passed on, so that they are not considered sold
+        if stub.location is None or stub.link in self.known_offers:
+            return False
+        plz = extract_plz(stub.location)
+        # Unknown postal codes are located after fetching the page
+        return plz is not None and is_known_plz(plz) and not is_plz_in_interest_locations(plz)
+
+    async def _scrape_offer(self, stub: OfferStub) -> Optional[Offer]:
+        known_offer = self.known_offers.get(stub.link)
+        if known_offer is not None and stub.is_unchanged(known_offer):
+            # Only the sold status and the scrape date of the known offer are updated later on
+            self.skipped_offer_page_fetches += 1
+            return replace(known_offer, sold=False, scraped_on=datetime.now())
+
+        try:
+            return await self.scrape_offer_url(stub.link)
+        except PermanentGETError:
+            print(f'Offer is no longer available: {stub.link}')
+            return None
+        except GETError:
+            print(f'Failed to scrape offer URL: {stub.link}')
+            return None
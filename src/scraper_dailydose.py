@@ -1,16 +1,22 @@
-import asyncio
-from bs4 import BeautifulSoup
-import pandas as pd
+import re
+from datetime import datetime
+
+from bs4 import BeautifulSoup, Tag
 
 from src.config_interests import BASE_URL_DAILYDOSE
-from src.util import get, overrides
+from src.lat_long import is_known_plz
+from src.util import overrides
 from src.scraper import BaseScraper
-from src.types import Offer, User
+from src.types import Offer, OfferStub, User
 
 
 class ScraperDailyDose(BaseScraper):
-    def __init__(self, max_pages_to_scrape: int = 1000):
-        super().__init__(offer_page_batch_size=5, max_offers_per_page=30, max_pages_to_scrape=max_pages_to_scrape)
+    base_url = BASE_URL_DAILYDOSE
+    max_offers_per_page = 30
+    offer_page_batch_size = 5
+    requests_per_second = 2.0
+    search_results_newest_first = True
+    burst = 5
 
     @overrides(BaseScraper)
     def filter_relevant_urls(self, urls: list[str]) -> list[str]:
@@ -18,7 +24,7 @@ class ScraperDailyDose(BaseScraper):
 
     @overrides(BaseScraper)
     async def scrape_offer_url(self, url: str) -> Offer:
-        html_content = await get(url)
+        html_content = await self.client.get(url)
         soup = BeautifulSoup(html_content, 'html.parser')
 
         # Navigate to the main 'foto_box' div to extract most details
@@ -66,28 +72,48 @@ class ScraperDailyDose(BaseScraper):
             sold=False,
             image_urls=offer_image_urls,
             user=user,
-            scraped_on=pd.Timestamp.now(),
+            scraped_on=datetime.now(),
         )
 
-        await asyncio.sleep(1)  # Sleep for 1 second to avoid getting blocked
-
         return offer
 
     @overrides(BaseScraper)
     async def scrape_offer_links_from_search_url(self, base_url: str) -> list[str | None]:
+        return [
+            stub.link if stub is not None else None for stub in await self.scrape_offer_stubs_from_search_url(base_url)
+        ]
+
+    @overrides(BaseScraper)
+    async def scrape_offer_stubs_from_search_url(self, base_url: str) -> list[OfferStub | None]:
         # Send a GET request to the specified URL
-        html_content = await get(base_url)
+        html_content = await self.client.get(base_url)
 
         # Parse the HTML content of the page
         soup = BeautifulSoup(html_content, 'html.parser')
 
         # Find all <a> tags and filter by href attribute
-        links: list[str | None] = []
+        stubs: list[OfferStub | None] = []
         for a in soup.find_all('a', href=True):
             href = a['href']
             if 'detail.htm' in href and 'ai=' in href:
-                links.append(BASE_URL_DAILYDOSE + '/' + href)
+                stubs.append(OfferStub(link=BASE_URL_DAILYDOSE + '/' + href, location=_location_of_listing(a)))
+
+        return stubs
+
+
+def _location_of_listing(a: Tag) -> str | None:
+    # Not all listings show a location. A text of the listing's row is only used as the location if it consists of nothing
+    # but a known postal code followed by a place, and only if exactly one such text exists. That way prices, article
+    # numbers or numbers in the title are not mistaken for a postal code, which would drop the offer in the prefilter
+    row = a.find_parent(['tr', 'li'])
+    if row is None:
+        return None
+    locations = {
+        text
+        for text in row.stripped_strings
+        if (match := _LOCATION_PATTERN.fullmatch(text)) is not None and is_known_plz(int(match.group(1)))
+    }
+    return locations.pop() if len(locations) == 1 else None
 
-        await asyncio.sleep(1)  # Sleep for 1 second to avoid getting blocked
 
-        return links
+_LOCATION_PATTERN = re.compile(r'(\d{5})\s+[A-ZÄÖÜ][\w\-. ]*')
@@ -3,7 +3,6 @@ from typing import Optional, List, Any
 import re
 import json
 import datetime
-import pandas as pd
 
 from bs4 import BeautifulSoup
 from contextlib import contextmanager
@@ -19,6 +18,7 @@ from webdriver_manager.chrome import ChromeDriverManager
 from src.scraper import BaseScraper
 from src.types import Offer, User
 from src.util.override import overrides
+from src.util.requests import HttpClient
 
 BUTTON_WAIT_TIMEOUT = 3
 SCROLL_TIMEOUT = 2
@@ -92,8 +92,12 @@ def get_product_data(url: str, browser: webdriver.Chrome) -> Any:
 
 
 class ScraperFacebook(BaseScraper):
-    def __init__(self, location: str, distance: float, max_pages_to_scrape: int = 1000):
-        super().__init__(offer_page_batch_size=10, max_offers_per_page=25, max_pages_to_scrape=max_pages_to_scrape)
+    base_url = FACEBOOK_BASE_URL
+    max_offers_per_page = 25
+    offer_page_batch_size = 10
+
+    def __init__(self, client: HttpClient, location: str, distance: float, max_pages_to_scrape: int = 1000):
+        super().__init__(client, max_pages_to_scrape=max_pages_to_scrape)
         self.browser = get_browser()
         self.location = location
         self.distance = distance
@@ -158,7 +162,7 @@ class ScraperFacebook(BaseScraper):
             sold=False,
             image_urls=offer_image_urls,
             user=user,
-            scraped_on=pd.Timestamp.now(),
+            scraped_on=datetime.datetime.now(),
         )
 
         return offer
@@ -258,12 +262,13 @@ async def main():
     distance = 90
     product = 'Windsurfing board'
 
-    scraper = ScraperFacebook(location=city, distance=distance)
-    all_offers = await scraper.scrape_all_offers(
-        [
-            URL.format(query=product),
-        ]
-    )
+    async with HttpClient() as client:
+        scraper = ScraperFacebook(client, location=city, distance=distance)
+        all_offers = await scraper.scrape_all_offers(
+            [
+                URL.format(query=product),
+            ]
+        )
 
     for offer in all_offers:
         print(offer)
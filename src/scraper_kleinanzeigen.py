@@ -1,15 +1,20 @@
+from datetime import datetime
+
 from bs4 import BeautifulSoup
-import pandas as pd
 
 from src.config_interests import BASE_URL_KLEINANZEIGEN
-from src.util import get, overrides
+from src.util import overrides
 from src.scraper import BaseScraper
-from src.types import Offer, User
+from src.types import Offer, OfferStub, User
 
 
 class ScraperKleinanzeigen(BaseScraper):
-    def __init__(self, max_pages_to_scrape: int = 1000):
-        super().__init__(offer_page_batch_size=10, max_offers_per_page=25, max_pages_to_scrape=max_pages_to_scrape)
+    base_url = BASE_URL_KLEINANZEIGEN
+    max_offers_per_page = 25
+    offer_page_batch_size = 10
+    requests_per_second = 4.0
+    search_results_newest_first = True
+    burst = 10
 
     @overrides(BaseScraper)
     def filter_relevant_urls(self, urls: list[str]) -> list[str]:
@@ -17,7 +22,7 @@ class ScraperKleinanzeigen(BaseScraper):
 
     @overrides(BaseScraper)
     async def scrape_offer_url(self, url: str) -> Offer:
-        html_content = await get(url)
+        html_content = await self.client.get(url)
         soup = BeautifulSoup(html_content, 'html.parser')
 
         # Extract offer details
@@ -70,31 +75,49 @@ class ScraperKleinanzeigen(BaseScraper):
             sold=False,
             image_urls=offer_image_urls,
             user=user,
-            scraped_on=pd.Timestamp.now(),
+            scraped_on=datetime.now(),
         )
 
         return offer
 
     @overrides(BaseScraper)
     async def scrape_offer_links_from_search_url(self, base_url: str) -> list[str | None]:
+        return [
+            stub.link if stub is not None else None for stub in await self.scrape_offer_stubs_from_search_url(base_url)
+        ]
+
+    @overrides(BaseScraper)
+    async def scrape_offer_stubs_from_search_url(self, base_url: str) -> list[OfferStub | None]:
         from src.config_interests import TITLE_NO_GO_KEYWORDS
 
         # Send a GET request to the specified URL
-        html_content = await get(base_url)
+        html_content = await self.client.get(base_url)
 
         # Parse the HTML content of the page
         soup = BeautifulSoup(html_content, 'html.parser')
 
-        # Find all <a> tags and filter by href attribute
-        links: list[str | None] = []
-        for a in soup.find_all('article'):
-            href = a['data-href']
+        # Find all offer cards and filter by their href attribute
+        stubs: list[OfferStub | None] = []
+        for article in soup.find_all('article'):
+            href = article['data-href']
             # Check if 's-anzeige' is in the URL and if the URL starts with the expected path
             if 's-anzeige' in href and href.startswith('/s-anzeige/'):
                 # check if the title contains any of the no-go keywords
                 if any(keyword in href.lower() for keyword in TITLE_NO_GO_KEYWORDS):
-                    links.append(None)
+                    stubs.append(None)
                 else:
-                    links.append(BASE_URL_KLEINANZEIGEN + href)
+                    stubs.append(
+                        OfferStub(
+                            link=BASE_URL_KLEINANZEIGEN + href,
+                            title=_text_of(article.find(class_='ellipsis')),
+                            price=_text_of(article.find(class_='aditem-main--middle--price-shipping--price')),
+                            location=_text_of(article.find(class_='aditem-main--top--left')),
+                            date=_text_of(article.find(class_='aditem-main--top--right')),
+                        )
+                    )
+
+        return stubs
+
 
-        return links
+def _text_of(tag) -> str | None:
+    return tag.text.strip() if tag else None
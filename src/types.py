@@ -1,25 +1,39 @@
 from __future__ import annotations
 import os
+import sys
 import json
-
-import pandas as pd
+import weakref
 
 from dataclasses import Field, dataclass, field, fields
+from datetime import datetime
+from functools import cache
 from typing import Callable
 
 
 from src.config import OFFER_IMAGE_DIR
-from src.lat_long import distance, plz_to_lat_long
-from src.util import log_all_exceptions, to_lower_snake_case, parse_numeric, to_readable_name, overrides
-
-
-@dataclass
+from src.lat_long import closest_interest_locations, distances_to_interest_locations, interest_locations_key
+from src.util import (
+    log_all_exceptions,
+    to_lower_snake_case,
+    parse_date,
+    parse_numeric,
+    parse_timestamp,
+    to_readable_name,
+    overrides,
+)
+
+
+@dataclass(slots=True)
 class ExcelExportType:
     number_format: str | None
-    value: str | float | pd.Timestamp
+    value: str | float | datetime
 
 
-@dataclass
+# The entries are held in memory by the hundreds of thousands, so all of them are slotted dataclasses
+# and values which repeat across offers (users, locations, dates, types) are shared instead of copied
+
+
+@dataclass(frozen=True, slots=True, weakref_slot=True)
 class User:
     id: str
     name: str
@@ -28,15 +42,18 @@ class User:
 
     @staticmethod
     def from_json(json_data: dict) -> 'User':
-        return User(
-            id=json_data['id'],
-            name=json_data['name'],
-            rating=json_data['rating'],
-            all_offers_link=json_data['all_offers_link'],
-        )
+        # All offers of a seller share one User instance, which is why it is frozen
+        key = (json_data['id'], json_data['name'], json_data['rating'], json_data['all_offers_link'])
+        if (user := _USERS.get(key)) is None:
+            user = _USERS[key] = User(*key)
+        return user
 
 
-@dataclass
+# Users by their fields, a user is dropped once no offer references it anymore
+_USERS: weakref.WeakValueDictionary[tuple[str, str, str, str], User] = weakref.WeakValueDictionary()
+
+
+@dataclass(slots=True)
 class Offer:
     id: str
     title: str
@@ -47,7 +64,7 @@ class Offer:
     link: str
     sold: bool
     image_urls: list[str]
-    scraped_on: pd.Timestamp
+    scraped_on: datetime | str  # the unchanged value if it could not be parsed
     user: User
 
     @staticmethod
@@ -56,9 +73,9 @@ class Offer:
         user = User.from_json(user_data)
 
         if 'scraped_on' not in data:
-            scraped_on = pd.Timestamp.now()
+            scraped_on = datetime.now()
         else:
-            scraped_on = pd.to_datetime(data['scraped_on'], errors='ignore', dayfirst=True)
+            scraped_on = parse_timestamp(data['scraped_on'])
 
         return Offer(
             user=user,
@@ -66,8 +83,8 @@ class Offer:
             title=data['title'],
             description=data['description'],
             price=data['price'],
-            location=data['location'],
-            date=data['date'],
+            location=sys.intern(data['location']),
+            date=sys.intern(data['date']),
             link=data['link'],
             sold=data['sold'],
             image_urls=data['image_urls'],
@@ -91,6 +108,27 @@ class Offer:
         )
 
 
+@dataclass(slots=True)
+class OfferStub:
+    # Lightweight offer as shown on a card of a search page, fields which the card does not show are None
+    link: str
+    title: str | None = None
+    price: str | None = None
+    location: str | None = None
+    date: str | None = None
+
+    def is_unchanged(self, offer: Offer) -> bool:
+        # Only the title and the price are shown the same way on the card and the offer page
+        # (the card shows relative dates and shortened locations), so both are required to detect that nothing changed
+        if self.title is None or self.price is None:
+            return False
+        return _normalize(self.title) == _normalize(offer.title) and _normalize(self.price) == _normalize(offer.price)
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(text.split()).lower()
+
+
 class DatabaseFactory:
     @staticmethod
     def from_json(json_data: dict) -> list[Entry]:
@@ -105,43 +143,58 @@ class DatabaseFactory:
     @staticmethod
     def parse_parial_entry(json_data: dict, offer: Offer, lat_long: tuple[float, float]) -> Entry:
         type = json_data.pop('type')
-        metadata = Metadata(type=type, offer=offer, lat_long=lat_long)
+        metadata = Metadata(type=sys.intern(type), offer=offer, lat_long=tuple(lat_long))
         return DatabaseFactory._parse_entry(json_data, metadata)
 
     @staticmethod
     def _parse_entry(json_data: dict, metadata: Metadata) -> Entry:
-        from src.types_to_search import ALL_TYPES
+        type_ = _entry_types_by_name().get(metadata.type)
+        if type_ is None:
+            raise ValueError(f'Unknown type: {metadata.type}')
+        return type_.from_json(metadata=metadata, json_data=json_data)
+
 
-        for type_ in ALL_TYPES + [Uninteresting]:
-            if do_types_match(metadata, type_):
-                return type_.from_json(metadata=metadata, json_data=json_data)
+@cache
+def _entry_types_by_name() -> dict[str, type[Entry]]:
+    from src.types_to_search import ALL_TYPES
 
-        raise ValueError(f'Unknown type: {metadata.type}')
+    return {to_lower_snake_case(type_.__name__): type_ for type_ in ALL_TYPES + [Uninteresting]}
 
 
-@dataclass
+@dataclass(slots=True)
 class Metadata:
     type: str
     offer: Offer
     lat_long: tuple[float, float]
+    # The closest interest location is computed once and stored with the entry, see closest_interest_location
+    closest_location_name: str | None = None
+    closest_location_distance: float | None = None
+    interest_locations_key: str | None = None  # of the INTEREST_LOCATIONS the closest location was computed for
 
     @staticmethod
     def from_json(json_data: dict) -> Metadata:
         offer = Offer.from_json(json_data['offer'])
-        return Metadata(offer=offer, type=json_data['type'], lat_long=json_data['lat_long'])
+        return Metadata(
+            offer=offer,
+            type=sys.intern(json_data['type']),
+            lat_long=tuple(json_data['lat_long']),
+            closest_location_name=json_data.get('closest_location_name'),
+            closest_location_distance=json_data.get('closest_location_distance'),
+            interest_locations_key=json_data.get('interest_locations_key'),
+        )
 
     @property
     def distance_to_interest_locations(self) -> dict[str, float]:
-        from src.config_interests import INTEREST_LOCATIONS
-
-        return {name: distance(self.lat_long, plz_to_lat_long(location)) for location, _, name in INTEREST_LOCATIONS}
+        return distances_to_interest_locations(self.lat_long)
 
     @property
     def closest_interest_location(self) -> tuple[str, float]:
-        return min(
-            self.distance_to_interest_locations.items(),
-            key=lambda x: (x[1], x[0]),
-        )
+        # Only computed if the INTEREST_LOCATIONS changed since it was stored
+        # Use update_closest_interest_locations to compute this for many entries at once
+        if self.interest_locations_key != interest_locations_key():
+            update_closest_interest_locations([self])
+        assert self.closest_location_name is not None and self.closest_location_distance is not None
+        return self.closest_location_name, self.closest_location_distance
 
     @property
     def price(self) -> float | str:
@@ -169,7 +222,7 @@ class Metadata:
             'Location': ExcelExportType(number_format=None, value=self.offer.location),
             'Date': ExcelExportType(
                 number_format='DD/MM/YYYY',
-                value=pd.to_datetime(self.offer.date, errors='ignore', dayfirst=True),
+                value=parse_date(self.offer.date),
             ),
             'Sold': ExcelExportType(number_format=None, value='Sold' if self.offer.sold else ''),
             'Link': ExcelExportType(number_format=None, value=self.offer.link),
@@ -182,18 +235,17 @@ class Metadata:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class Entry:
     metadata: Metadata
 
     def to_excel(self, do_add_metadata: bool = True) -> dict[str, ExcelExportType]:
         data: dict[str, ExcelExportType] = {}
-        for f in fields(self):
-            if is_parameter(f):
-                data[to_readable_name(f.name)] = ExcelExportType(
-                    number_format=f.metadata['number_format'],
-                    value=f.metadata['value_transformer'](getattr(self, f.name)),
-                )
+        for f in parameter_fields(type(self)):
+            data[to_readable_name(f.name)] = ExcelExportType(
+                number_format=f.metadata['number_format'],
+                value=f.metadata['value_transformer'](getattr(self, f.name)),
+            )
         if do_add_metadata:
             data.update(self.metadata.to_excel())
         return data
@@ -203,20 +255,19 @@ class Entry:
         # Automatically generate the description dictionary from the dataclass fields
         description_dict = {'type': to_lower_snake_case(cls.__name__)}
 
-        for f in fields(cls):
-            if is_parameter(f):
-                description_dict[f.name] = f.metadata['description']
+        for f in parameter_fields(cls):
+            description_dict[f.name] = f.metadata['description']
 
         return json.dumps(description_dict, indent=2, ensure_ascii=False)
 
     @classmethod
     def from_json(cls, metadata: Metadata, json_data: dict) -> Entry:
-        parameters = {f.name: json_data.get(f.name, '').replace('N/A', '') for f in fields(cls) if is_parameter(f)}
+        parameters = {f.name: json_data.get(f.name, '').replace('N/A', '') for f in parameter_fields(cls)}
 
         return cls(metadata=metadata, **parameters)
 
 
-@dataclass
+@dataclass(slots=True)
 class Uninteresting(Entry):
     @overrides(Entry)
     def to_excel(self, do_add_metadata: bool = True) -> dict[str, ExcelExportType]:
@@ -230,10 +281,26 @@ class Uninteresting(Entry):
         return Uninteresting(metadata=Metadata(type='uninteresting', offer=offer, lat_long=lat_long))
 
 
+def update_closest_interest_locations(metadatas: list[Metadata]) -> list[Metadata]:
+    # Compute the closest interest location of all metadatas which do not have it for the current INTEREST_LOCATIONS
+    # Returns the updated metadatas, so that only their entries have to be written to the database
+    key = interest_locations_key()
+    outdated = [metadata for metadata in metadatas if metadata.interest_locations_key != key]
+    if not outdated:
+        return []
+
+    names, distances = closest_interest_locations([metadata.lat_long for metadata in outdated])
+    for metadata, name, distance in zip(outdated, names, distances):
+        metadata.closest_location_name = name
+        metadata.closest_location_distance = float(distance)
+        metadata.interest_locations_key = key
+    return outdated
+
+
 def parameter(
     description: str,
     number_format: str | None = None,
-    value_transformer: Callable[[str], str | float | pd.Timestamp] = lambda x: x,
+    value_transformer: Callable[[str], str | float | datetime] = lambda x: x,
 ):
     return field(
         metadata={
@@ -251,6 +318,12 @@ def is_parameter(f: Field) -> bool:
     return f.metadata.get('is_parameter', False)
 
 
+@cache
+def parameter_fields(cls: type) -> tuple[Field, ...]:
+    # The fields of a dataclass never change, so they are only looked up once per class
+    return tuple(f for f in fields(cls) if is_parameter(f))
+
+
 def list_entries_of_type(entries: list[Entry], type: type[Entry]) -> list[Entry]:
     return [entry for entry in entries if do_types_match(entry.metadata, type)]
 
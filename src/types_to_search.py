@@ -3,7 +3,7 @@ from src.types import DatabaseFactory, Entry, ExcelExportType, Metadata, paramet
 from src.util import parse_numeric, indent, overrides
 
 
-@dataclass
+@dataclass(slots=True)
 class Sail(Entry):
     size: str = parameter('Size of the Sail in m²', '#,#0.0', parse_numeric)
     brand: str = parameter('Name of the Brand and Model')
@@ -22,7 +22,7 @@ class Sail(Entry):
     state: str = parameter('new, used, repaired, demaged, defective')
 
 
-@dataclass
+@dataclass(slots=True)
 class Board(Entry):
     size: str = parameter('Dimensions of the Board')
     brand: str = parameter('Name of the Brand and Model')
@@ -35,7 +35,7 @@ class Board(Entry):
     year: str = parameter('Release Year')
 
 
-@dataclass
+@dataclass(slots=True)
 class Mast(Entry):
     brand: str = parameter('Name of the Brand and Model')
     length: str = parameter('Length of the Mast in cm', '#0', parse_numeric)
@@ -43,21 +43,21 @@ class Mast(Entry):
     rdm_or_sdm: str = parameter('Either RDM or SDM')
 
 
-@dataclass
+@dataclass(slots=True)
 class Boom(Entry):
     brand: str = parameter('Name of the Brand and Model')
     size: str = parameter('Minimum and Maximum Size of the Boom in cm (e.g., 140-190)')
     year: str = parameter('Release Year')
 
 
-@dataclass
+@dataclass(slots=True)
 class FullSet(Entry):
     content_description: str = parameter(
         'Short description of what the set includes (e.g., Sail, Mast, Boom, Board, etc.)'
     )
 
 
-@dataclass
+@dataclass(slots=True)
 class FullRig(Entry):
     sail: Sail = parameter('To be generated below')
     mast: Mast = parameter('To be generated below')
@@ -95,7 +95,7 @@ class FullRig(Entry):
         return FullRig(metadata=metadata, sail=sail, mast=mast, boom=boom)  # type: ignore
 
 
-@dataclass
+@dataclass(slots=True)
 class Accessory(Entry):
     accessory_type: str = parameter(
         'Mastfoot, Mast extension, Harness Lines, Fins, Harness, Impact Vest, etc. Should be the Type of the Accessory, followed by a short description. E.g., "Harness Lines: 24-30 inch adjustable"'
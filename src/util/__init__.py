@@ -1,9 +1,13 @@
 from src.util.override import *
 from src.util.file import *
 from src.util.json import *
+from src.util.cache import *
 from src.util.contextmanager import *
 from src.util.mail import *
 from src.util.openai import *
 from src.util.string import *
 from src.util.requests import *
 from src.util.asynchronus import *
+from src.util.retry import *
+from src.util.ratelimit import *
+from src.util.pipeline import *
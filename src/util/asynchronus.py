@@ -1,7 +1,7 @@
 import asyncio
+from contextlib import aclosing
 from tqdm import tqdm
-from math import ceil
-from typing import Any, Coroutine, List, Callable, TypeVar
+from typing import Any, AsyncIterator, Coroutine, List, Callable, TypeVar
 
 from src.util.contextmanager import log_all_exceptions
 
@@ -13,7 +13,44 @@ async def _after_batch_noop(_: List[R]) -> bool:
     return True
 
 
-# Define the generic batched async executor
+async def stream_in_window(
+    items: List[T],
+    window_size: int,
+    async_func: Callable[[T], Coroutine[Any, Any, R]],
+    do_ignore_errors: bool = True,
+) -> AsyncIterator[tuple[int, R | None]]:
+    # Run the async function for each item while keeping up to window_size calls in flight at all times
+    # As soon as a call finishes the next item is started and (index of the item, result) is yielded
+    # Closing the iterator early (e.g. breaking out of the loop inside of aclosing) cancels all calls still in flight
+
+    async def _run(item: T) -> R | None:
+        if not do_ignore_errors:
+            return await async_func(item)
+
+        with log_all_exceptions('while processing item'):
+            return await async_func(item)
+        return None
+
+    in_flight: dict[asyncio.Task, int] = {}
+    next_index = 0
+
+    try:
+        while next_index < len(items) or in_flight:
+            while next_index < len(items) and len(in_flight) < window_size:
+                in_flight[asyncio.ensure_future(_run(items[next_index]))] = next_index
+                next_index += 1
+
+            done, _ = await asyncio.wait(in_flight.keys(), return_when=asyncio.FIRST_COMPLETED)
+
+            for task in sorted(done, key=in_flight.__getitem__):
+                yield in_flight.pop(task), task.result()
+    finally:
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+
+
+# Define the generic windowed async executor
 async def run_in_batches(
     items: List[T],
     batch_size: int,
@@ -22,37 +59,38 @@ async def run_in_batches(
     do_ignore_errors: bool = True,
     after_batch: Callable[[List[R | None]], Coroutine[Any, Any, bool]] = _after_batch_noop,
 ) -> List[R | None]:
-    # Run the async function for each item in the list in batches
-    # and return the results in the correct order
-    # After each batch, the after_batch function is called with the results of the batch, the function should return True to continue processing the next batch
+    # Run the async function for each item in the list with up to batch_size calls in flight at all times
+    # and return the results in the order of the items
+    # Once all items of a batch (and all batches before it) are done, the after_batch function is called with the results of the batch,
+    # the function should return True to continue processing, otherwise no further items are started
 
     # Initialize a list to store results in the correct order
     results: list[R | None] = [None] * len(items)
+    is_done = [False] * len(items)
+    next_batch_start = 0
+    should_continue = True
+
+    progress = tqdm(total=len(items), desc=desc, unit='item') if desc else None
+
+    async with aclosing(stream_in_window(items, batch_size, async_func, do_ignore_errors)) as stream:
+        async for index, result in stream:
+            results[index] = result
+            is_done[index] = True
+            if progress is not None:
+                progress.update()
+
+            # Report all batches which are now completely done, in order
+            while should_continue and next_batch_start < len(items):
+                batch_end = min(next_batch_start + batch_size, len(items))
+                if not all(is_done[next_batch_start:batch_end]):
+                    break
+                should_continue = await after_batch(results[next_batch_start:batch_end])
+                next_batch_start = batch_end
+
+            if not should_continue:
+                break
 
-    if not desc:
-        iterable = range(0, len(items), batch_size)
-    else:
-        iterable = tqdm(
-            range(0, len(items), batch_size),
-            desc=desc,
-            unit='batch',
-            total=ceil(len(items) / batch_size),
-        )
-
-    for batch_start in iterable:
-        batch_end = min(batch_start + batch_size, len(items))
-        batch = items[batch_start:batch_end]
-        item_futures = [async_func(item) for item in batch]
-
-        for i, future in enumerate(asyncio.as_completed(item_futures)):
-            # Wait for the result and store it in the corresponding position
-            if do_ignore_errors:
-                with log_all_exceptions('while processing batch'):
-                    results[batch_start + i] = await future
-            else:
-                results[batch_start + i] = await future
-
-        if not await after_batch(results[batch_start:batch_end]):
-            break
+    if progress is not None:
+        progress.close()
 
     return results
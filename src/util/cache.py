@@ -0,0 +1,164 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any
+
+from src.util.json import custom_asdict, json_dumps, json_loads, load_json
+
+
+class _Missing:
+    pass
+
+
+MISSING: Any = _Missing()  # returned by DiskCache.get for keys which are not cached
+
+
+class DiskCache:
+    """Key-value cache stored in a single SQLite file, shared by all processes which use the same file.
+    Entries expire after `ttl` seconds and the least recently used entries are evicted beyond `max_entries`.
+    Values are stored as JSON, so e.g. tuples are returned as lists.
+    The access times of hits are only written on the next evict() or flush().
+
+    cache = DiskCache('data/gpt_request_cache/cache.sqlite3', max_entries=50_000)
+    if (value := cache.get(key)) is MISSING:
+        value = compute()
+        cache.set(key, value)
+    """
+
+    EVICT_EVERY_N_WRITES = 100
+    MAX_INDEX_ENTRIES = 10_000  # entries kept in memory if there is no max_entries
+
+    def __init__(self, path: str, ttl: float | None = None, max_entries: int | None = None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # calls which waited for an identical call in flight instead (counted by cache_to_folder)
+        # The most recently used entries of this process, so repeated lookups do not touch the file
+        self._index: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self._max_index_entries = max_entries if max_entries is not None else self.MAX_INDEX_ENTRIES
+        # Access times of the hits since the last write of them, written together instead of one UPDATE per hit
+        self._accessed_at: dict[str, float] = {}
+        self._writes_since_eviction = 0
+        self._lock = threading.Lock()
+
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        # Other processes can hold the write lock for a moment, so wait for it instead of failing
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)')
+        self.evict()
+
+    def get(self, key: str) -> Any:
+        now = time.time()
+        with self._lock:
+            if key in self._index:
+                value, created_at = self._index[key]
+                if not self._is_expired(created_at, now):
+                    self._index.move_to_end(key)
+                    self._accessed_at[key] = now
+                    self.hits += 1
+                    return value
+                del self._index[key]
+
+            row = self._connection.execute('SELECT value, created_at FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None or self._is_expired(row[1], now):
+                self.misses += 1
+                return MISSING
+
+            self._accessed_at[key] = now
+            value = json_loads(row[0])
+            self._remember(key, value, row[1])
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        text = json_dumps(custom_asdict(value))
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, text, now, now),
+            )
+            # Read back from the JSON, so that hits from the index and from the file return the same values
+            self._remember(key, json_loads(text), now)
+            self._writes_since_eviction += 1
+
+        if self._writes_since_eviction >= self.EVICT_EVERY_N_WRITES:
+            self.evict()
+
+    def evict(self) -> None:
+        # Remove the expired entries and the least recently used entries beyond max_entries
+        with self._lock:
+            self._writes_since_eviction = 0
+            self._connection.execute('BEGIN IMMEDIATE')
+            self._write_access_times()
+            evicted: list[tuple[str]] = []
+            if self.ttl is not None:
+                evicted += self._connection.execute(
+                    'SELECT key FROM cache WHERE created_at < ?', (time.time() - self.ttl,)
+                ).fetchall()
+            if self.max_entries is not None:
+                evicted += self._connection.execute(
+                    'SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?', (self.max_entries,)
+                ).fetchall()
+            self._connection.executemany('DELETE FROM cache WHERE key = ?', evicted)
+            self._connection.execute('COMMIT')
+            for (key,) in evicted:
+                self._index.pop(key, None)
+
+    def flush(self) -> None:
+        # Write the access times of the hits, e.g. before the process exits
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            self._write_access_times()
+            self._connection.execute('COMMIT')
+
+    def import_json_files(self, folder_name: str) -> None:
+        # One-shot import of the JSON files written by earlier versions of cache_to_folder, only into an empty cache
+        if self._connection.execute('SELECT 1 FROM cache LIMIT 1').fetchone() is not None:
+            return
+
+        now = time.time()
+        rows = []
+        for file_name in sorted(os.listdir(folder_name)):
+            if file_name.endswith('.json'):
+                try:
+                    cached = load_json(f'{folder_name}/{file_name}')
+                except Exception:
+                    continue
+                rows.extend((key, json_dumps(value), now, now) for key, value in cached.items())
+
+        if rows:
+            with self._lock:
+                self._connection.execute('BEGIN IMMEDIATE')
+                self._connection.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', rows)
+                self._connection.execute('COMMIT')
+            print(f'Imported {len(rows)} cached results from {folder_name} into {self.path}')
+            self.evict()
+
+    def _write_access_times(self) -> None:
+        # Only moves the access times forward, another process could have used the entries more recently
+        self._connection.executemany(
+            'UPDATE cache SET accessed_at = ? WHERE key = ? AND accessed_at < ?',
+            ((accessed_at, key, accessed_at) for key, accessed_at in self._accessed_at.items()),
+        )
+        self._accessed_at.clear()
+
+    def _remember(self, key: str, value: Any, created_at: float) -> None:
+        self._index[key] = value, created_at
+        self._index.move_to_end(key)
+        while len(self._index) > self._max_index_entries:
+            self._index.popitem(last=False)
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and created_at < now - self.ttl
@@ -1,14 +1,15 @@
-from datetime import datetime
+import asyncio
 import hashlib
+import inspect
 import os
 import json
-import random
 import time
 from contextlib import contextmanager
 
 from typing import Any, Callable, Coroutine, Generator
 
-from src.util.json import custom_asdict, dump_json, load_json
+from src.util.cache import MISSING, DiskCache
+from src.util.json import custom_asdict
 
 
 @contextmanager
@@ -99,46 +100,82 @@ def generate_hashcode(data: Any) -> str:
     return hash_object.hexdigest()
 
 
-def cache_to_folder(folder_name: str) -> Callable[..., Callable[..., Coroutine[Any, Any, Any]]]:
-    # Wrapps a function that (optionally) returns a coroutine and caches the result to a file
+def cache_to_folder(
+    folder_name: str, ttl: float | None = None, max_entries: int | None = None
+) -> Callable[..., Callable[..., Coroutine[Any, Any, Any]]]:
+    # Wrapps a function that (optionally) returns a coroutine and caches the result in the folder
     # The parameters are thereby used as the cache key, so the function should be deterministic
-    def load_cache(folder_name: str) -> dict[str, Any]:
-        assert os.path.isdir(folder_name), f'"{folder_name}" is not a folder'
-
-        cache = {}
-        for file_name in os.listdir(folder_name):
-            if file_name.endswith('.json'):
+    # Callers can pass a small cache_key=... instead, which must cover everything the result depends on
+    # (e.g. digests instead of images), it is not passed on to the function
+    # The other arguments are then not serialized, so e.g. an expensive argument can be passed as a function building it
+    # Such a function must always come with a cache_key, as it would only be hashed by its name
+    # The results are stored in one SQLite file (see DiskCache), cached results expire after ttl seconds
+    # and the least recently used results are evicted beyond max_entries
+    # Concurrent calls with the same key are coalesced: only the first one calls the function, the others await its result
+    def decorator(func) -> Callable[..., Coroutine[Any, Any, Any]]:
+        async def wrapper(*args, **kwargs):
+            cache = _disk_cache(folder_name, ttl, max_entries)
+            cache_key = kwargs.pop('cache_key', None)
+            if cache_key is None and any(callable(argument) for argument in (*args, *kwargs.values())):
+                raise TypeError(f'{func.__name__} was called with a function as argument, but without a cache_key')
+            key = generate_hashcode(('cache_key', cache_key) if cache_key is not None else (args, kwargs))
+
+            while (in_flight := _in_flight.get((folder_name, key))) is not None:
+                cache.coalesced += 1
                 try:
-                    cache.update(load_json(f'{folder_name}/{file_name}'))
-                except Exception:
-                    pass
+                    # Shielded, so that cancelling this call does not cancel the call everyone else waits for
+                    return await asyncio.shield(in_flight)
+                except asyncio.CancelledError:
+                    if not in_flight.cancelled():
+                        raise
+                    # The call we waited for was cancelled, so try again ourselves
+
+            if (cached := cache.get(key)) is not MISSING:
+                return cached
+
+            future = asyncio.get_running_loop().create_future()
+            _in_flight[(folder_name, key)] = future
+            try:
+                result = func(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+
+                cache.set(key, result)
+                future.set_result(result)
+                return result
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                future.exception()  # Retrieved here, so that asyncio does not warn if no one else was waiting
+                raise
+            finally:
+                del _in_flight[(folder_name, key)]
 
-        if random.random() < 0.01:  # 1% chance to clean up the cache
-            dump_json(cache, f'{folder_name}/cache.json')
-            for file_name in os.listdir(folder_name):
-                if file_name.endswith('.json') and 'cache' not in file_name:
-                    with log_all_exceptions(f'Failed to remove file: {file_name}'):
-                        os.remove(f'{folder_name}/{file_name}')
-            dump_json(cache, f'{folder_name}/cache.json')
+        return wrapper
 
-        return cache
+    return decorator
 
-    def decorator(func) -> Callable[..., Coroutine[Any, Any, Any]]:
-        async def wrapper(*args, **kwargs):
-            os.makedirs(folder_name, exist_ok=True)
-            cache = load_cache(folder_name)
-            key = generate_hashcode((args, kwargs))
-            if key in cache:
-                return cache[key]
-            del cache
 
-            result = await func(*args, **kwargs)
+_disk_caches: dict[str, DiskCache] = {}
+_in_flight: dict[tuple[str, str], asyncio.Future] = {}
 
-            time_str_include_milliseconds = datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f')
-            new_file_name = f'{folder_name}/{time_str_include_milliseconds}.json'
-            dump_json({key: custom_asdict(result)}, new_file_name)
-            return result
 
-        return wrapper
+def _disk_cache(folder_name: str, ttl: float | None, max_entries: int | None) -> DiskCache:
+    # One cache per folder and process, opened on first use
+    if folder_name not in _disk_caches:
+        cache = DiskCache(f'{folder_name}/cache.sqlite3', ttl, max_entries)
+        cache.import_json_files(folder_name)
+        _disk_caches[folder_name] = cache
+    return _disk_caches[folder_name]
 
-    return decorator
+
+def flush_caches() -> None:
+    for cache in _disk_caches.values():
+        cache.flush()
+
+
+def print_cache_statistics() -> None:
+    for folder_name, cache in _disk_caches.items():
+        print(f'Cache {folder_name}: {cache.hits} hits, {cache.misses} misses, {cache.coalesced} coalesced')
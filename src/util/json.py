@@ -1,34 +1,67 @@
 import os
 import json
 from enum import Enum
-from typing import Any, Generic, Protocol, Type, TypeVar, overload
+from typing import Any, Callable, Generic, Iterator, Protocol, Type, TypeVar, overload
 from dataclasses import is_dataclass
-
-import pandas as pd
+from datetime import datetime
 
 from src.util.file import write_to_file
+from src.util.string import format_timestamp
+
+try:
+    import orjson  # optional, much faster than the json module for the database rows
+except ImportError:
+    orjson = None
+
+
+_PRIMITIVE_TYPES = {str, int, float, bool, type(None)}
+_SERIALIZERS: dict[type, Callable[[Any], Any]] = {}
 
 
 def custom_asdict(obj):
-    if is_dataclass(obj):
-        result = {}
-        for field_name, field_type in obj.__dataclass_fields__.items():
-            value = getattr(obj, field_name)
-            result[field_name] = custom_asdict(value)
-        return result
-    elif isinstance(obj, pd.Timestamp):
-        return obj.strftime('%Y-%m-%d %H:%M:%S')
-    elif isinstance(obj, Enum):
-        return obj.value
-    elif isinstance(obj, list) or isinstance(obj, tuple):
-        return tuple(custom_asdict(item) for item in obj)
-    elif isinstance(obj, dict):
-        return {key: custom_asdict(value) for key, value in obj.items()}
-    elif callable(obj):
-        return obj.__qualname__  # Save the function's qualname if it's a callable
-    else:
+    # Convert dataclasses (also nested ones), timestamps, enums and containers into JSON compatible values
+    # How a type is converted is only decided once, afterwards the cached serializer of the type is used
+    type_ = type(obj)
+    if type_ in _PRIMITIVE_TYPES:
         return obj
 
+    serializer = _SERIALIZERS.get(type_)
+    if serializer is None:
+        serializer = _SERIALIZERS[type_] = _make_serializer(type_, obj)
+    return serializer(obj)
+
+
+def _make_serializer(type_: type, obj: Any) -> Callable[[Any], Any]:
+    if is_dataclass(type_):
+        # Generated once per dataclass, e.g. for User: lambda obj: {'id': asdict(obj.id), 'name': asdict(obj.name), ...}
+        items = ', '.join(f'{name!r}: asdict(obj.{name})' for name in type_.__dataclass_fields__)
+        return eval(f'lambda obj: {{{items}}}', {'asdict': custom_asdict})
+    elif issubclass(type_, datetime):
+        return format_timestamp
+    elif issubclass(type_, Enum):
+        return lambda obj: obj.value
+    elif issubclass(type_, (list, tuple)):
+        return lambda obj: tuple(custom_asdict(item) for item in obj)
+    elif issubclass(type_, dict):
+        return lambda obj: {key: custom_asdict(value) for key, value in obj.items()}
+    elif callable(obj):  # decided by the type of the object, so the same for all objects of the type
+        return lambda obj: obj.__qualname__  # Save the function's qualname if it's a callable
+    else:
+        return lambda obj: obj
+
+
+def json_dumps(obj: Any) -> str:
+    # Compact JSON of already converted values (see custom_asdict), the output is the same with and without orjson
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def json_loads(text: str | bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
 
 T = TypeVar('T')
 
@@ -59,9 +92,9 @@ def load_json(file_name: str, obj_type: Type[FromJsonProtocol[T]] | None = None)
         file_content = f.read()
 
     try:
-        json_data = json.loads(file_content)
+        json_data = json_loads(file_content)
     except json.JSONDecodeError:
-        json_data = json.loads(file_content + ']')
+        json_data = json_loads(file_content + ']')
 
     if obj_type is None:
         return json_data
@@ -73,6 +106,68 @@ def load_json(file_name: str, obj_type: Type[FromJsonProtocol[T]] | None = None)
     return [obj_type.from_json(entry) for entry in json_data]
 
 
+def iter_json_array(file_name: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    # Incrementally parse a file containing a JSON array and yield its elements one by one
+    # The file is read in chunks and only the element which is currently being parsed is kept in memory
+    # A missing closing bracket (e.g. of an interrupted json_dumper) is tolerated, like in load_json
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    is_eof = False
+    is_started = False  # the opening bracket was read
+    expects_value = True  # a value (or the closing bracket) is expected next, otherwise a comma
+
+    with open(file_name, 'r') as file:
+
+        def read_more() -> None:
+            nonlocal buffer, position, is_eof
+            # Read at least as much as is already buffered, so that a large element is not parsed again too often
+            chunk = file.read(max(chunk_size, len(buffer) - position))
+            is_eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+
+            if position == len(buffer):
+                if is_eof:
+                    if not is_started:
+                        raise ValueError(f'{file_name} does not contain a JSON array')
+                    return
+                read_more()
+                continue
+
+            char = buffer[position]
+            if not is_started:
+                if char != '[':
+                    raise ValueError(f'{file_name} does not contain a JSON array')
+                is_started = True
+                position += 1
+            elif char == ']':
+                return
+            elif not expects_value:
+                if char != ',':
+                    raise ValueError(f'Expected "," or "]" in {file_name}, got: {buffer[position : position + 20]}')
+                expects_value = True
+                position += 1
+            else:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if is_eof:
+                        raise
+                    read_more()  # The element is not completely in the buffer yet
+                    continue
+                if end == len(buffer) and not is_eof:
+                    read_more()  # The element could continue in the next chunk (e.g. a number)
+                    continue
+                yield value
+                position = end
+                expects_value = False
+
+
 def dump_json(obj: Any, file_name: str) -> None:
     if os.path.exists(file_name):
         write_to_file(file_name + '.bak', open(file_name).read())
@@ -1,11 +1,128 @@
-from openai import AsyncOpenAI, OpenAI
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import httpx
+from openai import (
+    APIConnectionError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+from openai.types import CompletionUsage
 from openai.types.chat.completion_create_params import ResponseFormat
 
-from src.config import LLM_MODEL_ID, OPENAI_API_KEY, OPENAI_BASE_URL
+from src.config import (
+    LLM_MODEL_ID,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+)
 from src.util.contextmanager import cache_to_folder
+from src.util.ratelimit import RequestScheduler
+from src.util.retry import RetryPolicy, parse_retry_after
+
+
+class GPTRequestError(Exception):
+    """The request failed repeatedly for a temporary reason (rate limit, connection, server error).
+    Raised instead of returning the failure, so that it is not cached and the request is retried by the next run."""
+
+
+@dataclass
+class TokenUsage:
+    # Tokens of the requests sent to the API in this process, results from the cache are not counted
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0  # part of the prompt_tokens which the provider served from its prompt cache
+    completion_tokens: int = 0
+
+    def add(self, usage: CompletionUsage | None) -> None:
+        self.requests += 1
+        if usage is None:
+            return
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        if usage.prompt_tokens_details is not None:
+            self.cached_prompt_tokens += usage.prompt_tokens_details.cached_tokens or 0
+
+    def __str__(self) -> str:
+        cached_share = self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        return (
+            f'{self.requests} requests, {self.prompt_tokens} prompt tokens '
+            f'({self.cached_prompt_tokens} cached, {cached_share:.0%}), {self.completion_tokens} completion tokens'
+        )
+
+
+gpt_token_usage = TokenUsage()
+
+
+# One client per process, shared by the extraction and the interest filtering, so that connections are reused
+MAX_CONCURRENT_GPT_REQUESTS = 15
+GPT_REQUEST_TIMEOUT = httpx.Timeout(120, connect=10)
+GPT_CONNECTION_LIMITS = httpx.Limits(
+    max_connections=MAX_CONCURRENT_GPT_REQUESTS,
+    max_keepalive_connections=MAX_CONCURRENT_GPT_REQUESTS,
+    keepalive_expiry=60,
+)
+
+# All async requests are dispatched through the scheduler, as fast as the rate limits of the API key allow
+gpt_scheduler = RequestScheduler(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+GPT_RETRY_POLICY = RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=60.0)
+
+# Rough token estimates, the scheduler corrects its budget with the actual usage after each response
+CHARACTERS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4
+EXPECTED_COMPLETION_TOKENS = 200
+LOW_DETAIL_IMAGE_TOKENS = {'gpt-4o-mini': 2833}  # all other models: 85
+HIGH_DETAIL_IMAGE_TOKENS = {'gpt-4o-mini': 25501}  # 1024x1024 image, all other models: 765
+
+_async_client: AsyncOpenAI | None = None
+_sync_client: OpenAI | None = None
+_request_slots: asyncio.Semaphore | None = None
+
+
+def async_gpt_client() -> tuple[AsyncOpenAI, asyncio.Semaphore]:
+    # The client of this process and the semaphore which limits the number of concurrent requests with it
+    global _async_client, _request_slots
+    if _async_client is None or _request_slots is None:
+        _async_client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            timeout=GPT_REQUEST_TIMEOUT,
+            max_retries=0,  # retried in async_gpt_request, so that the scheduler learns about rate limit errors
+            http_client=DefaultAsyncHttpxClient(limits=GPT_CONNECTION_LIMITS, timeout=GPT_REQUEST_TIMEOUT),
+        )
+        _request_slots = asyncio.Semaphore(MAX_CONCURRENT_GPT_REQUESTS)
+    return _async_client, _request_slots
 
 
-@cache_to_folder('data/gpt_request_cache')
+def sync_gpt_client() -> OpenAI:
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = OpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            timeout=GPT_REQUEST_TIMEOUT,
+            http_client=DefaultHttpxClient(limits=GPT_CONNECTION_LIMITS, timeout=GPT_REQUEST_TIMEOUT),
+        )
+    return _sync_client
+
+
+async def close_gpt_clients() -> None:
+    # Closes the connections of the clients, call once at shutdown (a later request opens new clients)
+    global _async_client, _sync_client, _request_slots
+    if _async_client is not None:
+        await _async_client.close()
+    if _sync_client is not None:
+        _sync_client.close()
+    _async_client = _sync_client = _request_slots = None
+
+
+@cache_to_folder('data/gpt_request_cache', max_entries=100_000)
 def sync_gpt_request(
     prompt: list,
     temperature: float = 0.0,
@@ -13,7 +130,7 @@ def sync_gpt_request(
 ) -> tuple[bool, str]:
     # Sync request to the LLM_MODEL_ID model with the given prompt and temperature
     # Returns a tuple with a boolean indicating if the request was successful and the response content
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    client = sync_gpt_client()
 
     try:
         response = client.chat.completions.create(
@@ -25,27 +142,77 @@ def sync_gpt_request(
     except Exception:
         return False, ''
 
+    gpt_token_usage.add(response.usage)
     return response.choices[0].message.content is not None, response.choices[0].message.content or ''
 
 
-@cache_to_folder('data/gpt_request_cache')
+@cache_to_folder('data/gpt_request_cache', max_entries=100_000)
 async def async_gpt_request(
-    prompt: list,
+    prompt: list | Callable[[], list],
     temperature: float = 0.0,
     response_format: ResponseFormat = {'type': 'text'},
 ) -> tuple[bool, str]:
     # Async request to the LLM_MODEL_ID model with the given prompt and temperature
+    # The prompt can be a function building it, which requires a cache_key=... (see cache_to_folder)
+    # and is then only built on a cache miss
     # Returns a tuple with a boolean indicating if the request was successful and the response content
-    client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+    # Raises a GPTRequestError if the request still fails for a temporary reason after all retries
+    if callable(prompt):
+        prompt = prompt()
+    client, request_slots = async_gpt_client()
+    estimated_tokens = estimate_prompt_tokens(prompt) + EXPECTED_COMPLETION_TOKENS
 
-    try:
-        response = await client.chat.completions.create(
-            model=LLM_MODEL_ID,
-            messages=prompt,
-            temperature=temperature,
-            response_format=response_format,
-        )
-    except Exception as e:
-        return False, repr(e)
+    for attempt in range(GPT_RETRY_POLICY.max_attempts):
+        await gpt_scheduler.acquire(estimated_tokens)
+        try:
+            async with request_slots:
+                raw_response = await client.chat.completions.with_raw_response.create(
+                    model=LLM_MODEL_ID,
+                    messages=prompt,
+                    temperature=temperature,
+                    response_format=response_format,
+                )
+        except RateLimitError as e:
+            # Pause all requests until the budget is available again, not only this one
+            headers = e.response.headers
+            gpt_scheduler.update_from_headers(headers)
+            retry_after = parse_retry_after(headers.get('retry-after')) or gpt_scheduler.reset_time(headers)
+            gpt_scheduler.pause(GPT_RETRY_POLICY.backoff(attempt, retry_after))
+            error: Exception = e
+            continue
+        except (APIConnectionError, InternalServerError) as e:
+            await asyncio.sleep(GPT_RETRY_POLICY.backoff(attempt))
+            error = e
+            continue
+        except Exception as e:
+            return False, repr(e)
 
-    return response.choices[0].message.content is not None, response.choices[0].message.content or ''
+        response = raw_response.parse()
+        if response.usage is not None:
+            gpt_scheduler.record_usage(estimated_tokens, response.usage.total_tokens)
+        gpt_scheduler.update_from_headers(raw_response.headers)
+
+        gpt_token_usage.add(response.usage)
+        return response.choices[0].message.content is not None, response.choices[0].message.content or ''
+
+    raise GPTRequestError(f'GPT request failed after {GPT_RETRY_POLICY.max_attempts} attempts: {error!r}')
+
+
+def estimate_prompt_tokens(prompt: list) -> int:
+    # Estimate of the prompt tokens, which the API counts against the tokens per minute limit
+    tokens = 0
+    for message in prompt:
+        tokens += TOKENS_PER_MESSAGE
+        content = message['content']
+        if isinstance(content, str):
+            tokens += len(content) // CHARACTERS_PER_TOKEN
+            continue
+        for part in content:
+            if part['type'] == 'text':
+                tokens += len(part['text']) // CHARACTERS_PER_TOKEN
+            elif part['type'] == 'image_url':
+                if part['image_url'].get('detail') == 'low':
+                    tokens += LOW_DETAIL_IMAGE_TOKENS.get(LLM_MODEL_ID, 85)
+                else:
+                    tokens += HIGH_DETAIL_IMAGE_TOKENS.get(LLM_MODEL_ID, 765)
+    return tokens
@@ -0,0 +1,106 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Coroutine
+
+from src.util.contextmanager import log_all_exceptions
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[Any], Coroutine[Any, Any, Any]]  # returning None drops the item from the pipeline
+    concurrency: int = 1  # number of workers processing items of this stage in parallel
+    queue_size: int = 50  # maximum number of items waiting in front of this stage
+    processed: int = 0
+    passed: int = 0
+
+
+class _Done:
+    pass
+
+
+_DONE = _Done()  # sent once per worker to shut a stage down
+
+
+async def stream_pipeline(source: AsyncIterator[Any], stages: list[Stage]) -> AsyncIterator[Any]:
+    # Stream the items of the source through all stages and yield everything coming out of the last stage
+    # The stages are connected with bounded queues, so all stages work at the same time while a slow stage
+    # applies back pressure to the stages in front of it and the number of items in memory stays bounded
+    # Exceptions of a stage are logged and the item is dropped, the pipeline keeps running
+    queues: list[asyncio.Queue] = [asyncio.Queue(maxsize=stage.queue_size) for stage in stages]
+    output: asyncio.Queue = asyncio.Queue(maxsize=stages[-1].queue_size)
+    queues.append(output)
+
+    async def feed() -> None:
+        async for item in source:
+            await queues[0].put(item)
+
+    async def work(stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue) -> None:
+        while not isinstance(item := await inbox.get(), _Done):
+            result = None
+            with log_all_exceptions(f'in pipeline stage {stage.name}'):
+                result = await stage.func(item)
+            stage.processed += 1
+            if result is not None:
+                stage.passed += 1
+                await outbox.put(result)
+
+    async def run_stage(index: int) -> None:
+        stage = stages[index]
+        await asyncio.gather(*(work(stage, queues[index], queues[index + 1]) for _ in range(stage.concurrency)))
+
+    async def shut_down() -> None:
+        # Let the items already in the pipeline pass through before shutting down
+        for index, stage in enumerate(stages):
+            for _ in range(stage.concurrency):
+                await queues[index].put(_DONE)
+            await stage_tasks[index]
+        await output.put(_DONE)
+
+    async def run() -> None:
+        try:
+            await feed()
+        except asyncio.CancelledError:
+            # The consumer is gone and the stages are cancelled as well, so nothing would drain the queues
+            raise
+        except BaseException:
+            await shut_down()  # the exception of the source is raised afterwards
+            raise
+        await shut_down()
+
+    stage_tasks = [asyncio.ensure_future(run_stage(index)) for index in range(len(stages))]
+    runner = asyncio.ensure_future(run())
+
+    try:
+        while not isinstance(item := await output.get(), _Done):
+            yield item
+        await runner
+    finally:
+        for task in [runner, *stage_tasks]:
+            task.cancel()
+        await asyncio.gather(runner, *stage_tasks, return_exceptions=True)
+
+    for stage in stages:
+        print(f'Pipeline stage {stage.name}: {stage.processed} processed, {stage.passed} passed on')
+
+
+async def merge_async_iterators(*iterators: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    # Yield the items of all iterators as soon as they arrive, the iterators are advanced concurrently
+    # An exception of one of the iterators is raised right away
+    pending = {asyncio.ensure_future(anext(iterator)): iterator for iterator in iterators}
+
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                iterator = pending.pop(task)
+                try:
+                    item = task.result()
+                except StopAsyncIteration:
+                    continue
+                pending[asyncio.ensure_future(anext(iterator))] = iterator
+                yield item
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
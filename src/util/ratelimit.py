@@ -0,0 +1,140 @@
+import re
+import time
+import asyncio
+from typing import Mapping
+
+
+class TokenBucket:
+    """Allows on average `rate` acquisitions per second with bursts of up to `burst` acquisitions.
+
+    bucket = TokenBucket(rate=2, burst=5)
+    await bucket.acquire()  # returns immediately while tokens are left, otherwise waits for the next token
+    """
+
+    def __init__(self, rate: float, burst: int):
+        assert rate > 0 and burst >= 1, 'The rate must be positive and the burst at least one'
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()  # waiters are served in order
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class _MinuteBudget:
+    # Budget of `limit` units per minute which refills continuously
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.available = float(limit)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.available = min(self.limit, self.available + (now - self.updated_at) * self.limit / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self.refill(now)
+        return max(0.0, (amount - self.available) * 60 / self.limit)
+
+
+class RequestScheduler:
+    """Dispatches requests as fast as a requests per minute and a tokens per minute budget allow.
+    The budgets start from the configured limits and are corrected by the rate limit headers of the responses,
+    so that the actual quota of the API key is used (also if other processes use the same key).
+
+    scheduler = RequestScheduler(requests_per_minute=500, tokens_per_minute=200_000)
+    await scheduler.acquire(estimated_tokens)  # waits until the request fits into both budgets
+    response = await send_request()
+    scheduler.record_usage(estimated_tokens, response.used_tokens)
+    scheduler.update_from_headers(response.headers)
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        assert requests_per_minute > 0 and tokens_per_minute > 0, 'The limits must be positive'
+        self.requests = _MinuteBudget(requests_per_minute)
+        self.tokens = _MinuteBudget(tokens_per_minute)
+        self.paused_until = 0.0
+        self.waited_seconds = 0.0
+        self._lock = asyncio.Lock()  # waiters are served in order
+
+    async def acquire(self, tokens: int) -> None:
+        async with self._lock:
+            # A request larger than the whole budget still has to be sent at some point
+            tokens = min(tokens, int(self.tokens.limit))
+            while True:
+                now = time.monotonic()
+                wait = max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    break
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+            self.requests.available -= 1
+            self.tokens.available -= tokens
+
+    def record_usage(self, estimated_tokens: int, used_tokens: int) -> None:
+        # Give back (or take) the difference between the estimate taken by acquire and the actual usage
+        self.tokens.refill(time.monotonic())
+        self.tokens.available = min(self.tokens.limit, self.tokens.available + estimated_tokens - used_tokens)
+
+    def pause(self, seconds: float) -> None:
+        # No requests are dispatched for the next seconds, e.g. after the server answered with 429 Too Many Requests
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        # The x-ratelimit-* headers of OpenAI compatible APIs, missing or malformed headers are ignored
+        now = time.monotonic()
+        for budget, kind in [(self.requests, 'requests'), (self.tokens, 'tokens')]:
+            limit = _parse_float(headers.get(f'x-ratelimit-limit-{kind}'))
+            if limit is not None and limit > 0:
+                budget.refill(now)
+                budget.limit = limit
+            remaining = _parse_float(headers.get(f'x-ratelimit-remaining-{kind}'))
+            if remaining is not None:
+                # Only ever lowered: the tokens of the requests still in flight are already taken from the budget,
+                # but may not yet be counted in the remaining of the server
+                budget.refill(now)
+                budget.available = min(budget.available, remaining)
+
+    @staticmethod
+    def reset_time(headers: Mapping[str, str]) -> float | None:
+        # Seconds until the exhausted budget is available again according to the x-ratelimit-reset-* headers
+        resets = [
+            parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+            for kind in ['requests', 'tokens']
+            if _parse_float(headers.get(f'x-ratelimit-remaining-{kind}')) == 0
+        ]
+        resets = [reset for reset in resets if reset is not None]
+        return max(resets) if resets else None
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Parse durations like '1s', '6m0s' or '120ms' (as in the x-ratelimit-reset-* headers) into seconds."""
+    if not value:
+        return None
+
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts or ''.join(number + unit for number, unit in parts) != value.strip():
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def _parse_float(value: str | None) -> float | None:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
@@ -1,42 +1,196 @@
-import time
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+from urllib.parse import urlparse
+
 import aiohttp
 
+from src.util.ratelimit import TokenBucket
+from src.util.retry import CircuitBreaker, RetryPolicy, parse_retry_after
+
+T = TypeVar('T')
+
+# Accept-Encoding is left to aiohttp, which also offers br if brotli is installed
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
 
 class GETError(Exception):
     """Custom exception for GET request errors."""
 
 
-async def get(url: str) -> str:
-    """Send a GET request to the specified URL and return the response content.
-    Raises an GETError for repeated bad responses (4XX, 5XX)."""
+class PermanentGETError(GETError):
+    """The requested resource is permanently gone (404, 410), e.g. the offer has been deleted."""
+
+
+class CircuitOpenError(GETError):
+    """The host failed too often in a row, requests to it fail fast until it recovers."""
+
+
+class HttpClient:
+    """Pooled HTTP client which is shared by everything that runs during one scraping run.
+    Connections are kept alive and reused, DNS lookups are cached and responses are transparently decompressed.
+
+    async with HttpClient() as client:
+        html = await client.get('https://www.kleinanzeigen.de')
+    """
+
+    _current: 'HttpClient | None' = None
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_connections_per_host: int = 10,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        request_timeout: float = 60,
+        retry_policy: RetryPolicy | None = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 120,
+        is_process_wide: bool = True,
+    ):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.request_timeout = request_timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_process_wide = is_process_wide
+        self._session: aiohttp.ClientSession | None = None
+        self._circuit_breakers: dict[str, CircuitBreaker] = {}
+        self._rate_limits: dict[str, TokenBucket] = {}
+
+    @staticmethod
+    def current() -> 'HttpClient | None':
+        """The client of the currently running scraping run, if any."""
+        return HttpClient._current
+
+    async def __aenter__(self) -> 'HttpClient':
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+            ssl=False,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=DEFAULT_HEADERS,
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+            auto_decompress=True,
+        )
+        if self.is_process_wide:
+            HttpClient._current = self
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        if HttpClient._current is self:
+            HttpClient._current = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        assert self._session is not None, 'HttpClient must be used as an async context manager'
+        return self._session
+
+    async def get(self, url: str) -> str:
+        """Send a GET request to the specified URL and return the response content.
+        Raises a PermanentGETError if the URL is gone (404, 410), a CircuitOpenError if the host is currently down
+        and a GETError for repeated bad responses (4XX, 5XX)."""
+        return await self._get(url, lambda response: response.text())
 
-    async with aiohttp.ClientSession(headers={'User-Agent': 'Mozilla/5.0'}) as session:
-        for i in range(5):
+    async def get_bytes(self, url: str) -> bytes:
+        """Send a GET request to the specified URL and return the response content as bytes.
+        Raises a PermanentGETError if the URL is gone (404, 410), a CircuitOpenError if the host is currently down
+        and a GETError for repeated bad responses (4XX, 5XX)."""
+        return await self._get(url, lambda response: response.read())
+
+    def set_rate_limit(self, host: str, requests_per_second: float, burst: int) -> None:
+        """Limit all requests to the host (e.g. 'www.kleinanzeigen.de') to the given rate, retries included."""
+        self._rate_limits[host] = TokenBucket(requests_per_second, burst)
+
+    def circuit_breaker(self, host: str) -> CircuitBreaker:
+        if host not in self._circuit_breakers:
+            self._circuit_breakers[host] = CircuitBreaker(host, self.failure_threshold, self.reset_timeout)
+        return self._circuit_breakers[host]
+
+    async def _get(self, url: str, read: Callable[[aiohttp.ClientResponse], Awaitable[T]]) -> T:
+        host = urlparse(url).netloc
+        policy = self.retry_policy
+        breaker = self.circuit_breaker(host)
+        rate_limit = self._rate_limits.get(host)
+
+        for attempt in range(policy.max_attempts):
+            if not breaker.allow_request():
+                raise CircuitOpenError(f'Host {breaker.host} is currently down, not fetching: {url}')
+            # While the circuit is open, only the single trial request is allowed through
+            is_trial = breaker.is_open
+
+            retry_after: float | None = None
+            succeeded = False
             try:
-                async with session.get(url, ssl=False) as response:
-                    response.raise_for_status()  # Raise an error for bad responses
-                    return await response.text()
-            except:
-                print(f'Retrying GET request: {url}')
-                time.sleep(60 * i)  # Exponential backoff
+                if rate_limit is not None:
+                    await rate_limit.acquire()
+
+                async with self.session.get(url) as response:
+                    if policy.is_permanent(response.status):
+                        succeeded = True  # The host answered, only the resource is gone
+                        raise PermanentGETError(f'URL is gone ({response.status}): {url}')
+
+                    if response.status < 400:
+                        result = await read(response)
+                        succeeded = True
+                        return result
+
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    if response.status in policy.host_failure_statuses:
+                        breaker.record_failure()
+            except PermanentGETError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f'GET request failed ({e!r}): {url}')
+                breaker.record_failure()
+            except Exception as e:
+                # E.g. an undecodable response, retried like a bad response
+                print(f'GET request failed ({e!r}): {url}')
+            finally:
+                if succeeded:
+                    breaker.record_success()
+                elif is_trial and breaker.trial_in_flight:
+                    # Every other outcome of the trial (429, 403, exceptions, cancellation) keeps the circuit open
+                    breaker.record_failure()
+
+            if attempt + 1 < policy.max_attempts:
+                delay = policy.backoff(attempt, retry_after)
+                print(f'Retrying GET request in {delay:.1f} seconds: {url}')
+                await asyncio.sleep(delay)
 
         print(f'Failed to fetch URL after retries: {url}')
         raise GETError(f'Failed to fetch URL: {url}')
 
 
+async def get(url: str) -> str:
+    """Send a GET request to the specified URL and return the response content.
+    Uses the client of the current run if there is one, otherwise a short lived client is opened.
+    Raises a GETError (or one of its subclasses) for bad responses, see HttpClient.get."""
+
+    if client := HttpClient.current():
+        return await client.get(url)
+
+    async with HttpClient(is_process_wide=False) as client:
+        return await client.get(url)
+
+
 async def get_bytes(url: str) -> bytes:
     """Send a GET request to the specified URL and return the response content as bytes.
-    Raises an GETError for repeated bad responses (4XX, 5XX)."""
+    Uses the client of the current run if there is one, otherwise a short lived client is opened.
+    Raises a GETError (or one of its subclasses) for bad responses, see HttpClient.get."""
 
-    async with aiohttp.ClientSession(headers={'User-Agent': 'Mozilla/5.0'}) as session:
-        for i in range(5):
-            try:
-                async with session.get(url, ssl=False) as response:
-                    response.raise_for_status()
-                    return await response.read()
-            except:
-                print(f'Retrying GET request: {url}')
-                time.sleep(60 * i)  # Exponential backoff
+    if client := HttpClient.current():
+        return await client.get_bytes(url)
 
-        print(f'Failed to fetch URL after retries: {url}')
-        raise GETError(f'Failed to fetch URL: {url}')
+    async with HttpClient(is_process_wide=False) as client:
+        return await client.get_bytes(url)
@@ -0,0 +1,82 @@
+import time
+import random
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay: float = 2.0  # in seconds, doubled after every failed attempt
+    max_delay: float = 120.0  # upper bound for the computed backoff
+    max_retry_after: float = 600.0  # upper bound for delays requested by the server via Retry-After
+    jitter: float = 0.5  # fraction of the delay which is randomized, so that parallel retries spread out
+    permanent_statuses: frozenset[int] = frozenset({404, 410})  # the resource is gone, retrying will not help
+    host_failure_statuses: frozenset[int] = frozenset({500, 502, 503, 504})  # count towards the circuit breaker
+
+    def is_permanent(self, status: int) -> bool:
+        return status in self.permanent_statuses
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        # Exponential backoff with jitter, the Retry-After header of the server takes precedence if it is longer
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        delay = delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse the Retry-After header, which is either a number of seconds or a HTTP date."""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Stops requests to a host after too many consecutive failures.
+    After reset_timeout seconds a single trial request is let through, if it succeeds the circuit closes again."""
+
+    def __init__(self, host: str, failure_threshold: int = 5, reset_timeout: float = 120.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self.trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+
+        if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+            return False
+
+        self.trial_in_flight = True  # half open: let exactly one request probe the host
+        return True
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if self.consecutive_failures >= self.failure_threshold:
+            if self.opened_at is None:
+                print(f'Circuit for {self.host} opened after {self.consecutive_failures} consecutive failures')
+            self.opened_at = time.monotonic()
@@ -1,4 +1,6 @@
 import time
+from datetime import datetime
+from functools import lru_cache
 
 
 def to_lower_snake_case(s: str) -> str:
@@ -23,6 +25,49 @@ def parse_numeric(value: str) -> float | str:
         return value
 
 
+def format_timestamp(value: datetime | str) -> str:
+    # Canonical representation of timestamps in the database, e.g. 2024-10-17 13:00:00
+    # Unparseable timestamps (see parse_timestamp) are stored unchanged
+    if isinstance(value, str):
+        return value
+    return value.isoformat(sep=' ', timespec='seconds')
+
+
+def parse_timestamp(value: str) -> datetime | str:
+    # Fast path for timestamps written by format_timestamp, pandas is only used for other formats
+    # The value is returned unchanged if it can not be parsed, so that the offer is not lost
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+
+    import pandas as pd
+
+    try:
+        return pd.to_datetime(value, dayfirst=True).to_pydatetime()
+    except (ValueError, OverflowError):
+        print(f'Failed to parse the timestamp {value!r}, keeping it unchanged')
+        return value
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value: str) -> datetime | str:
+    # Parse the date shown on an offer (e.g. 17.10.2024), the value is returned unchanged if it is no date (e.g. 'Heute')
+    # Many offers share the same date, so the results are cached
+    for parse in (datetime.fromisoformat, lambda value: datetime.strptime(value, '%d.%m.%Y')):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+
+    import pandas as pd
+
+    try:
+        return pd.to_datetime(value, dayfirst=True).to_pydatetime()
+    except (ValueError, OverflowError):
+        return value
+
+
 def datetime_str() -> str:
     return date_str() + ' ' + time_str()
 
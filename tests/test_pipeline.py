@@ -0,0 +1,51 @@
+import asyncio
+from contextlib import aclosing
+
+from src.util.pipeline import Stage, stream_pipeline
+
+
+async def numbers(count: int):
+    for number in range(count):
+        yield number
+
+
+async def slow_double(number: int) -> int:
+    await asyncio.sleep(0.01)
+    return number * 2
+
+
+def test_all_items_pass_through():
+    async def consume() -> list[int]:
+        return [item async for item in stream_pipeline(numbers(100), [Stage('double', slow_double, concurrency=10)])]
+
+    assert sorted(asyncio.run(consume())) == [number * 2 for number in range(100)]
+
+
+def test_cancelling_the_consumer_mid_stream_does_not_hang():
+    async def consume() -> None:
+        async for _ in stream_pipeline(numbers(1000), [Stage('double', slow_double)]):
+            pass
+
+    async def cancel_mid_stream() -> None:
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.2)  # the source filled the queue in front of the slow stage by now
+        task.cancel()
+        done, _ = await asyncio.wait([task], timeout=3)
+        assert done, 'the pipeline did not shut down after the consumer was cancelled'
+        assert task.cancelled()
+
+    asyncio.run(cancel_mid_stream())
+
+
+def test_breaking_out_early_does_not_hang():
+    async def consume() -> int:
+        async with aclosing(stream_pipeline(numbers(1000), [Stage('double', slow_double)])) as items:
+            async for item in items:
+                if item >= 10:
+                    break
+        return item
+
+    async def consume_with_timeout() -> int:
+        return await asyncio.wait_for(consume(), timeout=3)
+
+    assert asyncio.run(consume_with_timeout()) >= 10